@@ -0,0 +1,78 @@
+import threading
+import unittest
+
+import numpy as np
+
+from batching import MicroBatcher
+
+
+class StubDetector:
+    # Records the forward passes, the detections of an image are its first pixel
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def preprocess(self, im0):
+        return im0  # already letterboxed
+
+    def infer(self, ims, im0_shapes, conf_thres=0.5, iou_thres=0.45, max_det=1000):
+        with self.lock:
+            self.calls.append([im.shape for im in ims])
+        if self.error is not None:
+            raise self.error
+        return [np.full((1, 6), im[0, 0, 0], dtype=np.float32) for im in ims]
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.detector = StubDetector()
+        self.batcher = MicroBatcher(self.detector, window=0.5, max_batch_size=8)
+
+    def image(self, value, shape=(640, 640, 3)):
+        return np.full(shape, value, dtype=np.uint8)
+
+    def test_window_shares_forward_pass(self):
+        futures = [self.batcher.submit(self.image(i)) for i in range(3)]
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual(len(self.detector.calls), 1)
+        self.assertEqual(len(self.detector.calls[0]), 3)
+        for i, result in enumerate(results):  # every request gets its own detections back
+            self.assertEqual(result[0, 0], i)
+
+    def test_full_batch_runs_before_window(self):
+        batcher = MicroBatcher(self.detector, window=60, max_batch_size=2)
+        futures = [batcher.submit(self.image(i)) for i in range(2)]
+        self.assertEqual([future.result(timeout=5)[0, 0] for future in futures], [0, 1])
+        self.assertEqual(len(self.detector.calls), 1)
+
+    def test_shapes_not_mixed(self):
+        shapes = [(640, 640, 3), (384, 640, 3), (640, 640, 3), (640, 384, 3)]
+        futures = [self.batcher.submit(self.image(i, shape)) for i, shape in enumerate(shapes)]
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual(len(self.detector.calls), 3)
+        for call in self.detector.calls:
+            self.assertEqual(len(set(call)), 1)  # one letterboxed shape per forward pass
+        self.assertEqual(sorted(len(call) for call in self.detector.calls), [1, 1, 2])
+        self.assertEqual([result[0, 0] for result in results], [0, 1, 2, 3])
+
+    def test_exception_reaches_every_future(self):
+        self.detector.error = RuntimeError('forward failed')
+        futures = [self.batcher.submit(self.image(i, shape))
+                   for i, shape in enumerate([(640, 640, 3), (640, 640, 3), (384, 640, 3)])]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, 'forward failed'):
+                future.result(timeout=5)
+
+        self.detector.error = None  # the batch thread keeps serving
+        self.assertEqual(self.batcher.detect(self.image(7))[0, 0], 7)
+
+    def test_detect_batch(self):
+        results = self.batcher.detect_batch([self.image(i) for i in range(4)])
+        self.assertEqual([result[0, 0] for result in results], [0, 1, 2, 3])
+        self.assertEqual(len(self.detector.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -44,6 +44,12 @@ class KingdominoBoard:
         Presents the score of the tiles in a grid
     get_score()
         Returns total score of a board
+    get_tiles()
+        Returns the tile names as rows of the grid
+    get_scores()
+        Returns the tile scores as rows of the grid
+    to_dict()
+        Returns the dimensions, tiles, scores and total score of a board
     """
 
     def __init__(self, tiles):
@@ -104,6 +110,21 @@ class KingdominoBoard:
         """ Returns total score of a board """
         return self.total_score
 
+    def get_tiles(self):
+        """ Returns the tile names as rows of the grid """
+        return [[self.board[y * self.x_dim + x].name for x in range(self.x_dim)] for y in range(self.y_dim)]
+
+    def get_scores(self):
+        """ Returns the tile scores as rows of the grid """
+        return [[self.board[y * self.x_dim + x].get_score() for x in range(self.x_dim)] for y in range(self.y_dim)]
+
+    def to_dict(self):
+        """ Returns the dimensions, tiles, scores and total score of a board """
+        return {'dimensions': [self.x_dim, self.y_dim],
+                'tiles': self.get_tiles(),
+                'scores': self.get_scores(),
+                'total': self.total_score}
+
     def _get_tile(self, x_mid, y_mid):
         """
         Gets a single tile based on its coordinates on the board
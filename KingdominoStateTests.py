@@ -20,6 +20,14 @@ class TestKingdominoBoard(unittest.TestCase):
         self.assertEqual((2, 2), board.get_dimensions())
         self.assertTrue("empty" in board.display_tiles())  # also checks add_empty_tiles works
 
+    def test_to_dict(self):
+        tiles = [self.cave_3_tile, self.cave_1_tile, self.cave_0_tile]
+        board = KingdominoBoard(tiles).to_dict()
+        self.assertEqual([2, 2], board['dimensions'])
+        self.assertEqual([["cave_1", "cave_0"], ["empty", "cave_3"]], board['tiles'])
+        self.assertEqual([[4, 4], [0, 4]], board['scores'])
+        self.assertEqual(12, board['total'])
+
     def test_handle_collision(self):
         for i in range(0, 1000):
             tiles = [self.empty_tile, self.wheat_0_tile]
@@ -0,0 +1,36 @@
+import unittest
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.requests = self.registry.register(Counter('requests_total', 'Requests served', ('endpoint',)))
+        self.depth = self.registry.register(Gauge('queue_depth', 'Images waiting'))
+        self.latency = self.registry.register(Histogram('stage_seconds', 'Stage time', ('stage',), buckets=(0.1, 1)))
+
+    def test_counter(self):
+        self.requests.inc('file')
+        self.requests.inc('file', amount=2)
+        self.assertIn('requests_total{endpoint="file"} 3', self.registry.render())
+
+    def test_gauge_function(self):
+        self.depth.set_function(lambda: 4)
+        self.assertIn('queue_depth 4', self.registry.render())
+
+    def test_histogram(self):
+        self.latency.observe(0.05, 'forward')
+        self.latency.observe(0.5, 'forward')
+        text = self.registry.render()
+        self.assertIn('# TYPE stage_seconds histogram', text)
+        self.assertIn('stage_seconds_bucket{stage="forward",le="0.1"} 1', text)
+        self.assertIn('stage_seconds_bucket{stage="forward",le="1"} 2', text)
+        self.assertIn('stage_seconds_bucket{stage="forward",le="+Inf"} 2', text)
+        self.assertIn('stage_seconds_count{stage="forward"} 2', text)
+        self.assertTrue(text.endswith('\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
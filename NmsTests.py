@@ -0,0 +1,46 @@
+import sys
+import unittest
+from pathlib import Path
+
+import torch
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from general import non_max_suppression, tile_nms
+
+
+class TestTileNms(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.pred = torch.rand(2, 300, 5 + 8)  # (bs, n, 5 + nc) xywh, objectness, class scores
+        self.pred[..., :4] *= 640
+
+    def test_same_as_generic_under_budget(self):
+        generic = non_max_suppression(self.pred, 0.5, 0.45, None, False, max_det=1000)
+        tiles = tile_nms(self.pred, 0.5, 0.45, max_tiles=81)
+        self.assertEqual(len(generic), len(tiles))
+        for a, b in zip(generic, tiles):
+            self.assertGreater(len(a), 0)
+            self.assertLessEqual(len(a), 81)
+            self.assertEqual(a.shape, b.shape)
+            self.assertTrue(torch.allclose(a, b))
+
+    def test_tile_budget(self):
+        generic = non_max_suppression(self.pred, 0.5, 0.45, None, False, max_det=1000)
+        tiles = tile_nms(self.pred, 0.5, 0.45, max_tiles=5)
+        for a, b in zip(generic, tiles):
+            self.assertEqual(5, len(b))
+            self.assertTrue(torch.allclose(a[:5], b))  # the highest scoring detections
+
+    def test_empty(self):
+        pred = self.pred.clone()
+        pred[..., 4] = 0  # no objectness
+        for det in tile_nms(pred, 0.5, 0.45):
+            self.assertEqual((0, 6), tuple(det.shape))
+
+
+if __name__ == '__main__':
+    unittest.main()
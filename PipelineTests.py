@@ -0,0 +1,158 @@
+import io
+import unittest
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from pipeline import _response, format_labels, load_picture, read_archive, score_batch, square_labels
+
+
+def old_labels(detections):
+    # /file labels as the app built them before detections stayed in memory: a label file of '%g ' lines with the
+    # newlines replaced by commas and the last one cut off
+    lines = ''.join(('%g ' * 5).rstrip() % tuple(row[:5]) + '\n' for row in detections.tolist())
+    return lines.replace('\n', ',')[:len(lines) - 1]
+
+
+class TestFormatLabels(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.detections = rng.random((20, 6), dtype=np.float32)
+        self.detections[:, 0] = rng.integers(0, 20, 20)  # class index
+
+    def test_same_as_label_files(self):
+        self.assertEqual(old_labels(self.detections), format_labels(self.detections))
+        self.assertEqual(old_labels(self.detections[:1]), format_labels(self.detections[:1]))
+
+    def test_empty(self):
+        empty = np.zeros((0, 6), dtype=np.float32)
+        self.assertEqual('', format_labels(empty))
+        self.assertEqual({'result': 300, 'labels': ''}, _response(empty))
+
+    def test_response(self):
+        self.assertEqual({'result': 200, 'labels': old_labels(self.detections)}, _response(self.detections))
+
+
+def old_picture(data, size=640):
+    # Upload as the app padded it to a white square and resized it before load_picture resized once
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    new_img = Image.new('RGB', (max(width, height), max(width, height)), (255, 255, 255))
+    new_img.paste(img, (0, 0))
+    return np.asarray(new_img.resize((size, size)))[:, :, ::-1]
+
+
+def encode(img, fmt):
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class TestLoadPicture(unittest.TestCase):
+
+    def assertSimilar(self, old, new, max_mean=2.0):
+        self.assertEqual(old.shape, new.shape)
+        self.assertLess(np.abs(old.astype(np.int16) - new.astype(np.int16)).mean(), max_mean)
+
+    def test_jpeg(self):
+        # large enough for a reduced-scale JPEG decode
+        rng = np.random.default_rng(0)
+        blocks = Image.fromarray(rng.integers(30, 256, (6, 8, 3), dtype=np.uint8))
+        data = encode(blocks.resize((1920, 1440), Image.BILINEAR), 'JPEG')
+        self.assertSimilar(old_picture(data), load_picture(data))
+
+    def test_palette_png(self):
+        # one-pixel checkerboard, a NEAREST resize would keep one of the two colours instead of blending them
+        checkerboard = (np.indices((960, 1280)).sum(0) % 2 + 1).astype(np.uint8)
+        img = Image.frombytes('P', (1280, 960), checkerboard.tobytes())
+        img.putpalette([0, 0, 0, 200, 40, 40, 40, 40, 200] + [0] * 759)
+        data = encode(img, 'PNG')
+        self.assertSimilar(old_picture(data), load_picture(data))
+
+    def test_rect(self):
+        data = encode(Image.new('RGB', (1600, 900), (10, 120, 30)), 'PNG')
+        self.assertEqual((384, 640, 3), load_picture(data, rect=True).shape)  # 640x360 padded to the stride
+
+    def test_elongated(self):
+        data = encode(Image.new('RGB', (5000, 3), (10, 120, 30)), 'PNG')
+        self.assertEqual((640, 640, 3), load_picture(data).shape)
+        self.assertEqual((32, 640, 3), load_picture(data, rect=True).shape)
+
+
+class StubDetector:
+    # One tile per picture, records the batches it is asked to run
+    def __init__(self):
+        self.batches = []
+
+    def detect_batch(self, im0s, conf_thres=0.5, iou_thres=0.45, max_det=1000, batch_size=8):
+        self.batches.append((len(im0s), batch_size))
+        return [np.array([[1, 0.5, 0.5, 0.1, 0.1, 0.9]], dtype=np.float32) for _ in im0s]
+
+
+class TestScoreArchive(unittest.TestCase):
+
+    def setUp(self):
+        picture = encode(Image.new('RGB', (320, 240), (10, 120, 30)), 'PNG')
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            archive.writestr('a.png', picture)
+            archive.writestr('corrupt.png', picture[:-8] + b'CORRUPT!')  # flipped after writing, CRC mismatch
+            archive.writestr('b.png', picture)
+            archive.writestr('undecodable.png', b'not a picture')
+            archive.writestr('notes.txt', b'skipped')
+        data = buffer.getvalue()
+        corrupt = data.index(b'CORRUPT!')
+        self.data = data[:corrupt] + b'corrupt!' + data[corrupt + 8:]  # same size, stored bytes no longer match
+        self.detector = StubDetector()
+
+    def test_corrupt_member(self):
+        pictures = list(read_archive(self.data, 'upload.zip'))
+        self.assertEqual(['a.png', 'corrupt.png', 'b.png', 'undecodable.png'], [name for name, _ in pictures])
+        self.assertIsInstance(pictures[1][1], Exception)
+
+        results = {r['name']: r for r in score_batch(self.detector, pictures, batch_size=4)}
+        self.assertEqual(200, results['a.png']['result'])
+        self.assertEqual(200, results['b.png']['result'])
+        self.assertEqual('1 0.5 0.5 0.1 0.1', results['a.png']['labels'])
+        self.assertEqual(400, results['corrupt.png']['result'])
+        self.assertEqual(400, results['undecodable.png']['result'])
+        self.assertEqual([(2, 4)], self.detector.batches)  # both good pictures in one batch of the configured size
+
+    def test_bad_archive(self):
+        results = list(score_batch(self.detector, read_archive(b'not a zip', 'upload.zip')))
+        self.assertEqual(1, len(results))
+        self.assertEqual(('upload.zip', 400), (results[0]['name'], results[0]['result']))
+
+
+class TestSquareLabels(unittest.TestCase):
+
+    def pixels_to_labels(self, boxes, height, width):
+        # [cls, x, y, w, h, conf] rows of pixel boxes normalized to a height x width picture
+        det = np.array([[3, x, y, w, h, 0.9] for x, y, w, h in boxes], dtype=np.float32)
+        det[:, [1, 3]] /= width
+        det[:, [2, 4]] /= height
+        return det
+
+    def test_landscape(self):
+        # 16:9 picture resized to 640x360 and padded to the stride, 640x384, in the top left corner of a 640 square
+        boxes = [(320, 180, 64, 36), (32, 350, 60, 20)]
+        det = square_labels(self.pixels_to_labels(boxes, 384, 640), (384, 640, 3))
+        np.testing.assert_allclose(det, self.pixels_to_labels(boxes, 640, 640), rtol=1e-6)
+
+    def test_portrait(self):
+        boxes = [(240, 320, 48, 64)]
+        det = square_labels(self.pixels_to_labels(boxes, 640, 480), (640, 480, 3))
+        np.testing.assert_allclose(det, self.pixels_to_labels(boxes, 640, 640), rtol=1e-6)
+
+    def test_square(self):
+        det = self.pixels_to_labels([(100, 200, 30, 40)], 640, 640)
+        np.testing.assert_array_equal(det, square_labels(det, (640, 640, 3)))
+
+    def test_empty(self):
+        self.assertEqual((0, 6), square_labels(np.zeros((0, 6)), (384, 640, 3)).shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from helpers import LoadImagesPrefetch
+
+
+class TestLoadImagesPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        rng = np.random.default_rng(0)
+        for i in range(11):  # more batches than ring buffers, the last one partial
+            img = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+            cv2.imwrite(str(Path(self.tmp.name) / f'{i:02d}.png'), img)
+
+    def loader(self, **kwargs):
+        return LoadImagesPrefetch(self.tmp.name, img_size=64, batch_size=2, workers=4, prefetch=2, **kwargs)
+
+    def test_ring_does_not_overwrite_yielded_batch(self):
+        expected = [ims.copy() for _, ims, *_ in self.loader()]  # fresh arrays per batch
+        dataset = self.loader(buffer=True)
+        buffers = set()
+        for i, (paths, ims, im0s, _, _) in enumerate(dataset):
+            for _, futures, _ in dataset.pending:  # let every read in flight land in its ring buffer
+                for f in futures:
+                    f.result()
+            np.testing.assert_array_equal(expected[i], ims)
+            self.assertEqual(len(paths), len(ims))
+            buffers.add(next(j for j, b in enumerate(dataset.buffers) if np.shares_memory(b, ims)))
+        self.assertEqual(len(expected), i + 1)
+        self.assertEqual(set(range(len(dataset.buffers))), buffers)  # every ring buffer was reused
+
+    def test_threads_stop_when_exhausted(self):
+        dataset = self.loader()
+        self.assertEqual(11, sum(len(paths) for paths, *_ in dataset))
+        self.assertIsNone(dataset.pool)
+
+    def test_close_early(self):
+        dataset = self.loader(buffer=True)
+        for _ in dataset:
+            break
+        pool = dataset.pool
+        dataset.close()
+        self.assertIsNone(dataset.pool)
+        self.assertFalse(dataset.pending)
+        with self.assertRaises(RuntimeError):  # shut down
+            pool.submit(print)
+        self.assertEqual(11, sum(len(paths) for paths, *_ in dataset))  # iterates again from the start
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import time
+import unittest
+
+from result_cache import PerceptualCache, ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResultCache(max_entries=2, ttl=None, params=('kd_mod_med.pt', 0.5, 0.45))
+
+    def test_key(self):
+        self.assertEqual(self.cache.key(b"board"), self.cache.key(b"board"))
+        self.assertNotEqual(self.cache.key(b"board"), self.cache.key(b"other board"))
+        other_thresholds = ResultCache(params=('kd_mod_med.pt', 0.25, 0.45))
+        self.assertNotEqual(self.cache.key(b"board"), other_thresholds.key(b"board"))
+
+    def test_hit_miss(self):
+        key = self.cache.key(b"board")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, [[3, 0.5, 0.5, 0.1, 0.1]])
+        self.assertEqual([[3, 0.5, 0.5, 0.1, 0.1]], self.cache.get(key))
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+        self.assertEqual(0.5, self.cache.stats()['hit_rate'])
+
+    def test_lru_eviction(self):
+        self.cache.put("a", [])
+        self.cache.put("b", [])
+        self.cache.get("a")  # b is now least recently used
+        self.cache.put("c", [])
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.01)
+        cache.put("a", [])
+        self.assertEqual([], cache.get("a"))
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, len(cache))
+
+
+class TestPerceptualCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PerceptualCache(max_entries=2, ttl=None, distance=4)
+        self.board = 0x0F0F_3C3C_F0F0_C3C3
+
+    def test_near_hit(self):
+        self.cache.put(self.board, [[3, 0.5, 0.5, 0.1, 0.1]])
+        self.assertEqual([[3, 0.5, 0.5, 0.1, 0.1]], self.cache.get(self.board))
+        self.assertIsNotNone(self.cache.get(self.board ^ 0b1011))  # 3 bits apart
+        self.assertIsNotNone(self.cache.get(self.board ^ (1 << 63 | 1 << 40 | 1 << 20 | 1)))  # 4 bits apart
+        self.assertIsNone(self.cache.get(self.board ^ 0b11111))  # 5 bits apart
+        self.assertEqual((3, 1), (self.cache.hits, self.cache.misses))
+
+    def test_closest(self):
+        self.cache.put(self.board, "far")
+        self.cache.put(self.board ^ 0b1, "close")
+        self.assertEqual("close", self.cache.get(self.board ^ 0b11))
+
+    def test_eviction(self):
+        self.cache.put(0, "a")
+        self.cache.put(0xFFFF_FFFF_0000_0000, "b")  # 32 bits apart from the others
+        self.cache.put(0xFFFF_FFFF_FFFF_FFFF, "c")
+        self.assertIsNone(self.cache.get(0))
+        self.assertFalse(any(0 in hashes for table in self.cache._tables for hashes in table.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
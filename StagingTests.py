@@ -0,0 +1,102 @@
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from helpers import StagingPool
+
+
+def reference(ims, hwc=True):
+    # The fresh tensor per batch put() replaces
+    if hwc:
+        ims = np.stack([x[:, :, ::-1] for x in ims])  # BGR to RGB
+        return torch.from_numpy(ims).permute(0, 3, 1, 2).float() / 255
+    return torch.from_numpy(ims if ims.ndim == 4 else ims[None]).float() / 255
+
+
+class TestStagingPool(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.pool = StagingPool(torch.device('cpu'))
+
+    def images(self, n, shape=(64, 96, 3)):
+        return [self.rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(n)]
+
+    def test_hwc(self):
+        ims = self.images(3)
+        im = self.pool.put(ims)
+        self.assertEqual(im.shape, (3, 3, 64, 96))
+        self.assertEqual(im.dtype, torch.float32)
+        self.assertTrue(torch.allclose(im, reference(ims)))
+        self.pool.release(im)
+
+    def test_chw(self):
+        ims = np.stack(self.images(2, (3, 64, 96)))
+        for x in (ims, ims[0]):  # BCHW batch and a single CHW image
+            im = self.pool.put(x, hwc=False)
+            self.assertTrue(torch.allclose(im, reference(x, hwc=False)))
+            self.pool.release(im)
+
+    def test_channels_last(self):
+        pool = StagingPool(torch.device('cpu'), channels_last=True)
+        ims = self.images(2)
+        im = pool.put(ims)
+        self.assertTrue(im.is_contiguous(memory_format=torch.channels_last))
+        self.assertTrue(torch.allclose(im, reference(ims)))
+        pool.release(im)
+
+    def test_smaller_batch_slices_pooled_buffer(self):
+        self.pool.release(self.pool.put(self.images(4)))
+        ims = self.images(2)
+        im = self.pool.put(ims)
+        self.assertEqual(self.pool.allocations, 1)
+        self.assertEqual(len(im), 2)
+        self.assertTrue(torch.allclose(im, reference(ims)))
+        self.pool.release(im)
+
+    def test_larger_batch_allocates(self):
+        self.pool.release(self.pool.put(self.images(2)))
+        ims = self.images(4)
+        im = self.pool.put(ims)
+        self.assertEqual(self.pool.allocations, 2)
+        self.assertTrue(torch.allclose(im, reference(ims)))
+        self.pool.release(im)
+
+    def test_reuse_after_release(self):
+        first = self.pool.put(self.images(2))
+        pointer = first.data_ptr()
+        self.pool.release(first)
+        ims = self.images(2)
+        im = self.pool.put(ims)
+        self.assertEqual(self.pool.allocations, 1)
+        self.assertEqual(im.data_ptr(), pointer)
+        self.assertTrue(torch.allclose(im, reference(ims)))  # no stale pixels of the first batch
+        self.pool.release(im)
+
+    def test_in_use_buffer_not_shared(self):
+        a_ims, b_ims = self.images(2), self.images(2)
+        a = self.pool.put(a_ims)
+        b = self.pool.put(b_ims)  # a is not released yet
+        self.assertEqual(self.pool.allocations, 2)
+        self.assertNotEqual(a.data_ptr(), b.data_ptr())
+        self.assertTrue(torch.allclose(a, reference(a_ims)))
+        self.pool.release(a)
+        self.pool.release(b)
+
+    def test_no_reuse(self):
+        pool = StagingPool(torch.device('cpu'), reuse=False)
+        for _ in range(3):
+            pool.release(pool.put(self.images(2)))
+        self.assertEqual(pool.allocations, 3)
+        self.assertEqual(pool.nbytes(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import unittest
+
+from worker_pool import WorkerPool
+
+
+class StubModel:
+    onnx = False
+
+    def share_memory(self):
+        pass
+
+
+class StubDetector:
+    # Doubles numbers, raises on 'error' and kills its worker process on 'exit'
+    def __init__(self, precision='fp32'):
+        self.model = StubModel()
+        self.precision = precision
+        self.warmup_time = 0.0
+
+    def configure(self, threads=None, channels_last=None):
+        pass
+
+    def warmup(self, batch_sizes=(1,), shapes=None):
+        pass
+
+    def detect(self, im0, conf_thres=0.5, iou_thres=0.45, max_det=1000):
+        if im0 == 'exit':
+            os._exit(3)  # no cleanup, like an OOM kill or a segfault
+        if im0 == 'error':
+            raise ValueError('bad picture')
+        return im0 * 2
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def pool(self, processes=2):
+        pool = WorkerPool(StubDetector(), processes=processes, threads=1, poll=0.05)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_results(self):
+        pool = self.pool()
+        self.assertEqual([2, 4, 6, 8, 10], pool.detect_batch([1, 2, 3, 4, 5]))
+        self.assertEqual(5, sum(worker['images'] for worker in pool.stats()))
+        self.assertEqual(0, pool.pending())
+
+    def test_error(self):
+        pool = self.pool()
+        with self.assertRaisesRegex(RuntimeError, 'failed: ValueError'):
+            pool.submit('error').result(timeout=10)
+        self.assertEqual(10, pool.submit(5).result(timeout=10))  # the worker keeps serving
+
+    def test_dead_worker(self):
+        pool = self.pool()
+        with self.assertRaisesRegex(RuntimeError, 'exited with code 3'):
+            pool.submit('exit').result(timeout=10)
+        futures = [pool.submit(i) for i in range(4)]
+        self.assertEqual([0, 2, 4, 6], [future.result(timeout=10) for future in futures])  # the other worker
+        self.assertEqual(1, sum(not worker['alive'] for worker in pool.stats()))
+        self.assertFalse(pool.ready())
+
+    def test_every_worker_dead(self):
+        pool = self.pool(processes=1)
+        dying, queued = pool.submit('exit'), pool.submit(1)
+        with self.assertRaisesRegex(RuntimeError, 'exited with code 3'):
+            dying.result(timeout=10)
+        with self.assertRaisesRegex(RuntimeError, 'every inference worker exited'):
+            queued.result(timeout=10)
+        with self.assertRaisesRegex(RuntimeError, 'every inference worker exited'):
+            pool.submit(2).result(timeout=10)  # fails at once instead of waiting forever
+        self.assertEqual(0, pool.pending())
+
+    def test_static_rejected(self):
+        with self.assertRaises(AssertionError):
+            WorkerPool(StubDetector(precision='static'), processes=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
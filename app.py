@@ -1,11 +1,72 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_restful import Resource, Api
-from PIL import Image
-from models.detect import run
+from pathlib import Path
+import io
+import json
 import os
+import sys
+import threading
+import zipfile
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from batching import MicroBatcher
+from detector import loaded_detectors
+from metrics import CACHE_LOOKUPS, CACHE_SIZE, IMAGES, QUEUE_DEPTH, REGISTRY, REQUESTS
+from metrics import observe_batch, observe_stage, timed
+from pipeline import read_archive, score_batch, score_picture
+from serving import CONF_THRES, IOU_THRES, MAX_BATCH_SIZE
+from serving import load_caches, load_detector, picture_options, warmup_shapes
+from worker_pool import WorkerPool
+
+BATCH_WINDOW = float(os.getenv('BATCH_WINDOW', 0))  # ms to collect concurrent uploads into one batch, 0 to disable
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 0))  # inference processes sharing the weights, 0 to disable
 
 app = Flask(__name__)
 api = Api(app)
+resident = detector = load_detector(threads=WORKER_PROCESSES <= 0)  # workers split the cores
+detector.on_stage, detector.on_batch = observe_stage, observe_batch  # not reported from WORKER_PROCESSES children
+PICTURE = picture_options(resident)  # uploads resized once to imgsz
+SHAPES = warmup_shapes(resident)
+if WORKER_PROCESSES > 0:
+    detector = WorkerPool(detector, processes=WORKER_PROCESSES, conf_thres=CONF_THRES, iou_thres=IOU_THRES,
+                          shapes=SHAPES)
+elif BATCH_WINDOW > 0:
+    detector = MicroBatcher(detector, window=BATCH_WINDOW / 1000, max_batch_size=MAX_BATCH_SIZE,
+                            conf_thres=CONF_THRES, iou_thres=IOU_THRES)
+if not isinstance(detector, WorkerPool):  # workers warm up themselves after the fork
+    threading.Thread(target=resident.warmup, args=(range(1, MAX_BATCH_SIZE + 1), SHAPES), name='warmup',
+                     daemon=True).start()
+cache, near_cache = load_caches(resident)
+
+
+def ready():
+    return detector.ready() if isinstance(detector, WorkerPool) else resident.warmed
+
+
+def queue_depth():
+    if isinstance(detector, WorkerPool):
+        return detector.pending()
+    return detector.queue.qsize() if isinstance(detector, MicroBatcher) else 0
+
+
+def cache_lookups():
+    lookups = {}
+    for name, c in (('exact', cache), ('near', near_cache)):
+        if c is not None:
+            lookups[name, 'hit'], lookups[name, 'miss'] = c.hits, c.misses
+    return lookups
+
+
+def cache_size():
+    return {(name,): len(c) for name, c in (('exact', cache), ('near', near_cache)) if c is not None}
+
+
+QUEUE_DEPTH.set_function(queue_depth)
+CACHE_LOOKUPS.set_function(cache_lookups)
+CACHE_SIZE.set_function(cache_size)
 
 
 class File(Resource):
@@ -17,40 +78,104 @@ class File(Resource):
         return response
 
     def post(self):
+        REQUESTS.inc('file')
         img_file = request.files['picture']
+        score = request.values.get('score', '0').lower() in ('1', 'true', 'yes')
+        with timed('read'):
+            data = img_file.read()
+
+        # decode, detect and format in memory
+        result = score_picture(detector, data, cache, near_cache, score=score, **PICTURE)
+        IMAGES.inc('file')
+        if score:  # compact JSON, the Flutter client slicing the default response never asks for the board
+            return Response(json.dumps(result, separators=(',', ':')), mimetype='application/json')
+        return jsonify(result)
+
+
+class Batch(Resource):
+
+    def post(self):
+        # many 'picture' parts and/or zip archives of pictures in one request
+        REQUESTS.inc('batch')
+        score = request.values.get('score', '0').lower() in ('1', 'true', 'yes')
+        pictures = []
+        for img_file in request.files.getlist('picture') + request.files.getlist('archive'):
+            with timed('read'):
+                data = img_file.read()
+            if zipfile.is_zipfile(io.BytesIO(data)):
+                pictures.append(read_archive(data, img_file.filename))
+            else:
+                pictures.append([(img_file.filename, data)])
+
+        # one JSON result per line, streamed as each batch finishes
+        results = score_batch(detector, (p for archive in pictures for p in archive), cache, near_cache,
+                              batch_size=MAX_BATCH_SIZE, score=score, **PICTURE)
+
+        def lines():
+            for r in results:
+                IMAGES.inc('batch')
+                yield json.dumps(r, separators=(',', ':')) + '\n'
+
+        response = Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+
 
-        # Read the image via file.stream
-        img = Image.open(img_file.stream)
-        width, height = img.size
-        padded_width = 0 if width >= height else height - width
-        padded_height = 0 if width <= height else width - height
+class Models(Resource):
+
+    def get(self):
+        response = jsonify({'status': 200, 'models': loaded_detectors()})
+
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+
+
+class Workers(Resource):
+
+    def get(self):
+        workers = detector.stats() if isinstance(detector, WorkerPool) else []
+        response = jsonify({'status': 200, 'workers': workers})
+
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
 
-        new_img = Image.new('RGB', (padded_width + width, padded_height + height), (255, 255, 255))
-        new_img.paste(img, img.getbbox())
-        img = new_img.resize((640, 640))
-        img.save(os.path.join('temp', img_file.filename))
 
-        # run through models and receive list
-        run(weights='models/kd_mod_med.pt', source=os.path.join('temp', img_file.filename),
-            project='receive', name='', exist_ok=True)
-        txt_filename = img_file.filename.split('.')[0] + '.txt'
-        with open(os.path.join('receive', txt_filename)) as txt_file:
-            labels = txt_file.read()
+class Cache(Resource):
 
-        # remove img from temp
-        os.remove(os.path.join('temp', img_file.filename))
+    def get(self):
+        response = jsonify({'status': 200,
+                            'cache': cache.stats() if cache is not None else {},
+                            'near_cache': near_cache.stats() if near_cache is not None else {}})
+
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+
+
+class Ready(Resource):
 
-        status = 300 if len(labels) == 0 else 200
-        if status == 300:
-            try:
-                os.remove(os.path.join('receieve', img_file.filename[:len(img_file.filename)-3] + 'txt'))
-            except:
-                pass
-        return jsonify({'result': status, 'labels': labels.replace('\n', ',')[:len(labels)-1]})
+    def get(self):
+        # readiness probe, 503 until the models are warmed up for every batch size
+        is_ready = ready()
+        response = jsonify({'status': 200 if is_ready else 503, 'ready': is_ready})
+        response.status_code = 200 if is_ready else 503
+        return response
+
+
+class Metrics(Resource):
+
+    def get(self):
+        return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 api.add_resource(File, '/file')
+api.add_resource(Batch, '/batch')
+api.add_resource(Models, '/models')
+api.add_resource(Workers, '/workers')
+api.add_resource(Cache, '/cache')
+api.add_resource(Ready, '/ready')
+api.add_resource(Metrics, '/metrics')
 
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=8000)
+    # no reloader, it would load the models and fork the inference workers a second time
+    app.run(debug=True, use_reloader=False, host="0.0.0.0", port=8000)
     # app.run(debug=True)
@@ -0,0 +1,197 @@
+"""
+asyncio serving mode for the /file endpoint
+
+Uploads are read on the event loop and handed to a fixed-size inference
+executor through a bounded queue. Once the queue is full new uploads are
+answered with 503 and a Retry-After header instead of waiting. Requests and
+responses are the same as app.py, so the Flutter client works with either,
+and the models, host profile and caches are set up by the same environment
+variables (see serving.py).
+
+Usage:
+    $ python async_app.py
+"""
+
+import asyncio
+import functools
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from aiohttp import web
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from pipeline import score_picture
+from serving import load_caches, load_detector, picture_options, warmup_shapes
+
+WORKERS = int(os.getenv('WORKERS', 2))  # inference threads
+MAX_QUEUE = int(os.getenv('MAX_QUEUE', 16))  # uploads waiting for inference before answering 503
+RETRY_AFTER = int(os.getenv('RETRY_AFTER', 1))  # seconds a rejected client should wait
+
+
+class InferenceQueue:
+    """
+    Bounded queue in front of a fixed-size inference executor.
+
+    ...
+
+    Attributes
+    ---------
+    detector : Detector
+        the resident detector
+    queue : asyncio.Queue
+        pending (upload, score, future) requests, at most max_queue of them
+    executor : ThreadPoolExecutor
+        runs the CPU-bound decode, inference and formatting
+
+    Methods
+    -------
+    start()
+        Starts one consumer task per executor thread
+    submit(data, score=False)
+        Queues an upload, raises asyncio.QueueFull when the queue is full
+    """
+
+    def __init__(self, detector, workers=2, max_queue=16, cache=None, near_cache=None):
+        """
+        Parameters
+        ----------
+        detector : Detector
+            the resident detector
+        workers : int, default=2
+            number of inference threads
+        max_queue : int, default=16
+            most uploads waiting for a free inference thread
+        cache : ResultCache, optional
+            detections of previous uploads, checked before decoding
+        near_cache : PerceptualCache, optional
+            detections of previous uploads of the same board
+        """
+        self.detector = detector
+        self.cache, self.near_cache = cache, near_cache
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self._tasks = []
+
+    def start(self):
+        """ Starts one consumer task per executor thread """
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """ Cancels the consumers and shuts the executor down """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    def submit(self, data, score=False):
+        """
+        Queues an upload without waiting
+
+        Parameters
+        ----------
+        data : bytes
+            the encoded image as uploaded
+        score : bool, default=False
+            also build and score the board server-side
+
+        Raises
+        ------
+        asyncio.QueueFull
+            if max_queue uploads are already waiting
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((data, score, future))
+        return future
+
+    async def _consume(self):
+        """ Feeds queued uploads to the executor one at a time """
+        loop = asyncio.get_running_loop()
+        scorer = functools.partial(score_picture, cache=self.cache, near_cache=self.near_cache,
+                                   **picture_options(self.detector))
+        while True:
+            data, score, future = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(self.executor, functools.partial(scorer, score=score),
+                                                    self.detector, data)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():  # client may have disconnected
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+
+def json_response(obj, status=200, headers=None):
+    # Same bytes as app.py's jsonify in debug mode, the Flutter client slices the body by position
+    text = json.dumps(obj, indent=2, separators=(',', ': '), sort_keys=True) + '\n'
+    return web.Response(text=text, status=status, headers=headers, content_type='application/json')
+
+
+async def get_file(request):
+    return json_response({'status': 200}, headers={'Access-Control-Allow-Origin': '*'})
+
+
+async def post_file(request):
+    # read the multipart body on the event loop, in memory
+    data, score = None, request.query.get('score', '0')
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == 'picture':
+            data = await part.read()
+        elif part.name == 'score':
+            score = await part.text()
+    if data is None:
+        raise web.HTTPBadRequest(reason="missing 'picture' file")
+    score = score.lower() in ('1', 'true', 'yes')
+
+    try:
+        future = request.app['inference'].submit(data, score)
+    except asyncio.QueueFull:
+        raise web.HTTPServiceUnavailable(headers={'Retry-After': str(RETRY_AFTER)})
+    result = await future
+    if score:  # compact JSON like app.py, the Flutter client slicing the default response never asks for the board
+        return web.Response(text=json.dumps(result, separators=(',', ':')), content_type='application/json')
+    return json_response(result)
+
+
+async def get_ready(request):
+    # readiness probe, 503 until the models are warmed up
+    ready = request.app['inference'].detector.warmed
+    return json_response({'status': 200 if ready else 503, 'ready': ready}, status=200 if ready else 503)
+
+
+async def start_inference(app):
+    detector = load_detector()
+    cache, near_cache = load_caches(detector)
+    app['inference'] = InferenceQueue(detector, workers=WORKERS, max_queue=MAX_QUEUE, cache=cache,
+                                      near_cache=near_cache)
+    app['inference'].start()
+    shapes = warmup_shapes(detector)  # one upload per forward pass, so batch size 1 only
+    asyncio.get_running_loop().run_in_executor(None, detector.warmup, (1,), shapes)  # in the background, see /ready
+
+
+async def stop_inference(app):
+    await app['inference'].stop()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get('/file', get_file)
+    app.router.add_post('/file', post_file)
+    app.router.add_get('/ready', get_ready)
+    app.on_startup.append(start_inference)
+    app.on_cleanup.append(stop_inference)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host="0.0.0.0", port=8000)
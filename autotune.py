@@ -0,0 +1,107 @@
+"""
+Autotune CPU inference for this host: torch intra-op threads, channels_last memory format, batch size and
+inference size
+
+Every configuration is run end-to-end over the corpus like benchmark.py, the fastest one is written to a
+profile file that app.py applies at startup (AUTOTUNE_PROFILE, default autotune.json). Smaller inference
+sizes are only considered if they leave the detections of the corpus unchanged, so tune on real pictures.
+
+Usage:
+    $ python autotune.py --source pictures/images/val --output autotune.json
+    $ python autotune.py --threads 2 4 8 --batch-sizes 1 4 8 --imgsz 640 576 512
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+from pathlib import Path
+
+import torch
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from benchmark import accuracy, decode, load_corpus, run_config, synthetic_corpus
+from detector import get_detector
+
+
+def thread_counts(cpus=None):
+    # Powers of two up to the core count, and the core count itself
+    cpus = cpus or os.cpu_count() or 1
+    counts = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+    return sorted(set(counts + [cpus]))
+
+
+def run(weights='models/kd_mod_med.pt',  # models path
+        source=None,  # directory or glob of pictures
+        synthetic=16,  # number of synthetic pictures if no source
+        threads=None,  # torch thread counts to try, default powers of two up to the core count
+        batch_sizes=(1, 2, 4, 8),  # batch sizes to try
+        imgsz=(640,),  # square inference sizes to try, the first one is the accuracy reference
+        min_unchanged=0.99,  # share of pictures whose detections must match the reference inference size
+        repeats=2,  # passes over the corpus per configuration
+        device='cpu',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        output='autotune.json',  # profile file
+        ):
+    corpus = load_corpus(source) if source else list(synthetic_corpus(synthetic))
+    pictures = [decode(data) for _, data in corpus]
+    threads = threads or thread_counts()
+    results, reference = [], None
+    for size in imgsz:
+        detector = get_detector(weights, device=device, imgsz=(size, size))
+        dets = detector.predict(pictures)
+        reference = dets if reference is None else reference
+        unchanged = accuracy(dets, reference)['unchanged']
+        if unchanged < min_unchanged:
+            print(f'imgsz {size}: {unchanged:.1%} of detections unchanged, skipped')
+            continue
+
+        for channels_last in (False, True):
+            detector.configure(channels_last=channels_last)
+            for t in threads:
+                for b in batch_sizes:
+                    r = run_config(detector, corpus, b, t, repeats)
+                    r.update(imgsz=[size, size], channels_last=channels_last, unchanged=unchanged)
+                    results.append(r)
+                    print(f"imgsz {size:>4}  channels_last {channels_last:d}  threads {t:>3}  batch {b:>3}  "
+                          f"{r['throughput']:>8} img/s  p95 {r['latency']['p95']:>8} ms")
+        detector.configure(channels_last=False)
+
+    best = max(results, key=lambda r: r['throughput'])
+    profile = {'cpus': os.cpu_count(),  # read_profile ignores profiles tuned on other hosts
+               'platform': platform.platform(),
+               'torch': torch.__version__,
+               'weights': str(weights),
+               'threads': best['threads'],
+               'channels_last': best['channels_last'],
+               'batch_size': best['batch_size'],
+               'imgsz': best['imgsz'],
+               'throughput': best['throughput'],
+               'results': results}
+    Path(output).write_text(json.dumps(profile, indent=2))
+    print(f"\nBest of {len(results)}: threads {best['threads']}, channels_last {best['channels_last']}, "
+          f"batch {best['batch_size']}, imgsz {best['imgsz'][0]} at {best['throughput']} img/s, saved to {output}")
+    return profile
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='models/kd_mod_med.pt', help='models path')
+    parser.add_argument('--source', type=str, default=None, help='directory or glob of pictures')
+    parser.add_argument('--synthetic', type=int, default=16, help='number of synthetic pictures if no --source')
+    parser.add_argument('--threads', nargs='+', type=int, default=None, help='torch threads to try')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 2, 4, 8], help='batch sizes to try')
+    parser.add_argument('--imgsz', nargs='+', type=int, default=[640], help='square inference sizes to try')
+    parser.add_argument('--min-unchanged', type=float, default=0.99, help='required detection agreement vs imgsz[0]')
+    parser.add_argument('--repeats', type=int, default=2, help='passes over the corpus per configuration')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--output', type=str, default='autotune.json', help='profile file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    run(**vars(opt))
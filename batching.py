@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+
+
+class MicroBatcher:
+    """
+    Groups images submitted by concurrent requests into a single forward
+    pass of the detector.
+
+    ...
+
+    Attributes
+    ---------
+    detector : Detector
+        the resident detector the batches are run through
+    window : float
+        seconds to wait for more requests after the first one of a batch
+    max_batch_size : int
+        the most images run in one forward pass
+    queue : Queue
+        pending (image, original shape, future) requests
+
+    Methods
+    -------
+    submit(im0)
+        Queues a BGR HWC image and returns a Future of its detections
+    detect(im0)
+        Blocks until the detections of a BGR HWC image are available
+    detect_batch(im0s, batch_size=None)
+        Blocks until the detections of several BGR HWC images are available
+    """
+
+    def __init__(self, detector, window=0.01, max_batch_size=8, conf_thres=0.5, iou_thres=0.45, max_det=1000):
+        """
+        Parameters
+        ----------
+        detector : Detector
+            the resident detector
+        window : float, default=0.01
+            seconds to collect requests for before running a batch
+        max_batch_size : int, default=8
+            a batch is run as soon as it holds this many images
+        conf_thres : float, default=0.5
+            confidence threshold
+        iou_thres : float, default=0.45
+            NMS IoU threshold
+        max_det : int, default=1000
+            maximum detections per image
+        """
+        self.detector = detector
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_det = max_det
+        self.queue = Queue()
+
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, im0):
+        """
+        Queues an image for the next batch. Letterboxing happens on the
+        calling thread so the batch thread only stacks and runs the models.
+
+        Parameters
+        ----------
+        im0 : numpy.ndarray
+            HWC uint8 image in BGR channel order
+        """
+        future = Future()
+        self.queue.put((self.detector.preprocess(im0), im0.shape, future))
+        return future
+
+    def detect(self, im0):
+        """ Blocks until the [cls, x, y, w, h, conf] detections of an image are available """
+        return self.submit(im0).result()
+
+    def detect_batch(self, im0s, batch_size=None):
+        """
+        Queues several images at once and blocks until all their detections
+        are available. batch_size is accepted like Detector.detect_batch,
+        batches are capped at max_batch_size.
+        """
+        return [future.result() for future in [self.submit(im0) for im0 in im0s]]
+
+    def _collect(self):
+        """ Waits for a first request then gathers more until the window closes or the batch is full """
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        """ Batch loop, runs on its own daemon thread """
+        while True:
+            batch = self._collect()
+            shapes = {}  # letterboxed shape -> requests, only same-shape images can be stacked
+            for request in batch:
+                shapes.setdefault(request[0].shape, []).append(request)
+
+            for requests in shapes.values():
+                ims, im0_shapes, futures = zip(*requests)
+                try:
+                    results = self.detector.infer(ims, im0_shapes, self.conf_thres, self.iou_thres, self.max_det)
+                except Exception as e:  # fail the waiting requests, keep serving
+                    for future in futures:
+                        future.set_exception(e)
+                    continue
+                for future, result in zip(futures, results):
+                    future.set_result(result)
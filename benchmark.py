@@ -0,0 +1,392 @@
+"""
+End-to-end benchmark of the request path: decode -> resize/pad -> infer -> NMS -> board scoring
+
+Reports throughput, p50/p95/p99 latency, per-stage time and peak RSS for every precision mode, batch
+size and thread count, writes them as JSON and optionally compares them with a stored baseline.
+Precision modes are also compared for accuracy, against the detections of the first mode and
+against the ground truth labels of the pictures if given.
+
+Usage:
+    $ python benchmark.py --source pictures/images/val --batch-sizes 1 4 8 --threads 1 2 4 --output bench.json
+    $ python benchmark.py --synthetic 32 --baseline bench.json
+    $ python benchmark.py --synthetic 32 --max-tiles 49
+    $ python benchmark.py --synthetic 32 --staging --batch-sizes 8
+    $ python benchmark.py --weights models/kd_mod_small.pt models/kd_mod_med.pt --ensemble --batch-sizes 1
+    $ python benchmark.py --source pictures/images/val --labels pictures/labels/val --tta --batch-sizes 1
+    $ python benchmark.py --source pictures/images/val --labels pictures/labels/val --precisions fp32 bf16 static
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from detector import get_detector
+from general import non_max_suppression, tile_nms
+from helpers import IMG_FORMATS, StagingPool, source_files
+from pipeline import load_picture, score_board
+
+
+def synthetic_corpus(n, size=(1280, 960), seed=0):
+    # JPEG photos of random 5x5 coloured grids on a white table, sized like a phone picture
+    rng = np.random.default_rng(seed)
+    w, h = size
+    tile = min(w, h) // 7
+    for i in range(n):
+        grid = Image.fromarray(rng.integers(0, 256, (5, 5, 3), dtype=np.uint8)).resize((tile * 5, tile * 5),
+                                                                                       Image.NEAREST)
+        img = Image.new('RGB', size, (255, 255, 255))
+        img.paste(grid, ((w - tile * 5) // 2, (h - tile * 5) // 2))
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=90)
+        yield f'synthetic_{i}.jpg', buffer.getvalue()
+
+
+def load_corpus(source):
+    # (name, bytes) of every picture in a file, directory or glob
+    p, files = source_files(source)
+    files = [f for f in files if f.split('.')[-1].lower() in IMG_FORMATS]
+    assert files, f'No images found in {p}'
+    return [(Path(f).name, Path(f).read_bytes()) for f in files]
+
+
+def reset_peak_rss():
+    # Resets the peak RSS of this process to its current RSS (Linux), returns False where that is not possible
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    # Peak resident set size in MB, since the last reset_peak_rss() on Linux. Elsewhere ru_maxrss, the peak of the
+    # whole process (KB on Linux, bytes on macOS)
+    try:
+        with open('/proc/self/status') as f:
+            return next(round(int(line.split()[1]) / 1E3, 1) for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(rss / (1E6 if platform.system() == 'Darwin' else 1E3), 1)
+
+
+def percentiles(latencies):
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1E3, [50, 95, 99])
+    return {'p50': round(p50, 2), 'p95': round(p95, 2), 'p99': round(p99, 2)}  # ms
+
+
+def box_iou_xywh(a, b):
+    # IoU matrix of (n,4) and (m,4) [x, y, w, h] boxes
+    a1, a2 = a[:, None, :2] - a[:, None, 2:] / 2, a[:, None, :2] + a[:, None, 2:] / 2
+    b1, b2 = b[None, :, :2] - b[None, :, 2:] / 2, b[None, :, :2] + b[None, :, 2:] / 2
+    inter = (np.minimum(a2, b2) - np.maximum(a1, b1)).clip(0).prod(2)
+    return inter / (a[:, None, 2:].prod(2) + b[None, :, 2:].prod(2) - inter + 1E-9)
+
+
+def matches(det, ref, iou_thres=0.5):
+    # Number of [cls, x, y, w, h, ...] det rows matching a distinct ref row of the same class with IoU >= iou_thres
+    if not len(det) or not len(ref):
+        return 0
+    iou = box_iou_xywh(det[:, 1:5], ref[:, 1:5]) * (det[:, None, 0] == ref[None, :, 0])
+    used = set()
+    for i in range(len(det)):  # greedy, best IoU first
+        for j in np.argsort(-iou[i]):
+            if iou[i, j] < iou_thres:
+                break
+            if j not in used:
+                used.add(j)
+                break
+    return len(used)
+
+
+def accuracy(dets, reference=None, labels=None):
+    # Share of pictures with detections unchanged from reference, and precision/recall against ground truth labels
+    result = {}
+    if reference is not None:
+        same = [len(d) == len(r) == matches(d, r, 0.9) for d, r in zip(dets, reference)]
+        result['unchanged'] = round(sum(same) / len(same), 4)
+    if labels is not None:
+        pairs = [(d, t) for d, t in zip(dets, labels) if t is not None]
+        tp = sum(matches(d, t) for d, t in pairs)
+        result['precision'] = round(tp / max(sum(len(d) for d, _ in pairs), 1), 4)
+        result['recall'] = round(tp / max(sum(len(t) for _, t in pairs), 1), 4)
+    return result
+
+
+def load_labels(corpus, labels):
+    # (n,5) ground truth [cls, x, y, w, h] of every picture, None if it has no label file
+    files = [Path(labels) / f'{Path(name).stem}.txt' for name, _ in corpus]
+    return [np.loadtxt(f, ndmin=2).reshape(-1, 5) if f.exists() else None for f in files]
+
+
+def decode(data):
+    # Picture as uploaded, BGR HWC without the app's square padding, in the frame of its label file
+    return np.ascontiguousarray(np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))[:, :, ::-1])
+
+
+def run_config(detector, corpus, batch_size, threads, repeats=3, conf_thres=0.5, iou_thres=0.45):
+    # Benchmarks the full request path over the corpus in batches of batch_size with threads torch threads
+    torch.set_num_threads(threads)
+    reset_peak_rss()  # peak_rss of this configuration, not of the ones before it
+    stages = {}
+
+    def record(stage, seconds):
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def batches():
+        for i in range(0, len(corpus), batch_size):
+            yield corpus[i:i + batch_size]
+
+    def score(batch):
+        t = time.perf_counter()
+        im0s = [load_picture(data, max(detector.imgsz)) for _, data in batch]
+        record('load', time.perf_counter() - t)
+        dets = detector.detect_batch(im0s, conf_thres, iou_thres, batch_size=batch_size)
+        t = time.perf_counter()
+        for det in dets:
+            try:
+                score_board(det)
+            except Exception:  # random detections may not form a board
+                pass
+        record('board', time.perf_counter() - t)
+
+    score(next(batches()))  # warmup
+    stages.clear()
+    detector.on_stage = record
+    allocations, allocated = detector.staging.allocations, detector.staging.allocated
+    latencies = []
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        for batch in batches():
+            t = time.perf_counter()
+            score(batch)
+            latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - t0
+    detector.on_stage = None
+
+    images = repeats * len(corpus)
+    return {'precision': detector.precision,
+            'batch_size': batch_size,
+            'threads': threads,
+            'images': images,
+            'throughput': round(images / total, 2),  # images per second
+            'latency': percentiles(latencies),  # ms per batch
+            'stages': {k: round(v / images * 1E3, 3) for k, v in stages.items()},  # ms per image
+            'staging': {'allocations': detector.staging.allocations - allocations,  # input tensors allocated
+                        'allocated': round((detector.staging.allocated - allocated) / images / 1E6, 3),  # MB/image
+                        'resident': round(detector.staging.nbytes() / 1E6, 2)},  # MB held by the pool
+            'peak_rss': peak_rss()}  # MB
+
+
+def compare_nms(detector, corpus, batch_size=8, max_tiles=49, repeats=10, conf_thres=0.5, iou_thres=0.45):
+    # Times generic and tile-budget NMS on the same raw predictions, and the share of images they agree on
+    ims = [detector.preprocess(load_picture(data, max(detector.imgsz))) for _, data in corpus]
+    preds = []
+    with torch.no_grad():
+        for i in range(0, len(ims), batch_size):
+            im = detector.staging.put(ims[i:i + batch_size])
+            try:
+                preds.append(detector.model(im))
+            finally:
+                detector.staging.release(im)
+
+    methods = {'generic': lambda p: non_max_suppression(p, conf_thres, iou_thres, None, False, max_det=1000),
+               'tiles': lambda p: tile_nms(p, conf_thres, iou_thres, max_tiles=max_tiles)}
+    times, dets = {}, {}
+    for name, nms in methods.items():
+        t = time.perf_counter()
+        for _ in range(repeats):
+            dets[name] = [det for pred in preds for det in nms(pred)]
+        times[name] = (time.perf_counter() - t) / (repeats * len(ims)) * 1E3  # ms per image
+
+    same = [len(a) == len(b) and torch.allclose(a, b) for a, b in zip(dets['generic'], dets['tiles'])]
+    return {'batch_size': batch_size,
+            'max_tiles': max_tiles,
+            'generic': round(times['generic'], 3),  # ms per image
+            'tiles': round(times['tiles'], 3),  # ms per image
+            'speedup': round(times['generic'] / times['tiles'], 2),
+            'unchanged': round(sum(same) / len(same), 4)}
+
+
+def compare_staging(detector, corpus, batch_size=8, repeats=3):
+    # Throughput, input tensor allocations and peak RSS with a fresh input tensor per batch, then with the reused
+    # staging buffers. run_config resets the peak RSS, so each mode reports its own peak (Linux)
+    staging, rows = detector.staging, []
+    for reuse in (False, True):
+        detector.staging = StagingPool(detector.device, detector.channels_last, reuse=reuse)
+        gc.collect()  # buffers of the previous mode
+        r = run_config(detector, corpus, batch_size, torch.get_num_threads(), repeats)
+        rows.append({'reuse': reuse, 'throughput': r['throughput'], 'latency': r['latency'],
+                     'tensor': r['stages'].get('tensor'), **r['staging'], 'peak_rss': r['peak_rss']})
+    detector.staging = staging
+    return rows
+
+
+def compare_tta(weights, corpus, truth=None, device='cpu', batch_size=1, repeats=3):
+    # Latency and accuracy of plain inference, sequential TTA and batched TTA, detections compared with plain inference
+    pictures = [decode(data) for _, data in corpus]
+    rows, reference = [], None
+    for mode, name in ((False, 'none'), (True, 'sequential'), ('batched', 'batched')):
+        detector = get_detector(weights, device=device, augment=mode)
+        r = run_config(detector, corpus, batch_size, torch.get_num_threads(), repeats)
+        dets = detector.predict(pictures)
+        reference = dets if reference is None else reference
+        rows.append({'augment': name, 'throughput': r['throughput'], 'latency': r['latency'],
+                     **accuracy(dets, reference, truth)})
+    return rows
+
+
+def compare_ensemble(weights, corpus, truth=None, device='cpu', batch_size=1, repeats=3):
+    # Latency and accuracy of an ensemble of several weights for every fusion, members run sequentially and in parallel
+    pictures = [decode(data) for _, data in corpus]
+    rows, reference = [], None
+    for fusion in ('nms', 'mean', 'max'):
+        for parallel in (False, True):
+            try:
+                detector = get_detector(weights, device=device, fusion=fusion, parallel=parallel)
+                r = run_config(detector, corpus, batch_size, torch.get_num_threads(), repeats)
+            except (AssertionError, RuntimeError) as e:  # mean/max need members with the same output shape
+                print(f'ensemble {fusion}: {e}')
+                break
+            dets = detector.predict(pictures)
+            reference = dets if reference is None else reference
+            rows.append({'fusion': fusion, 'parallel': parallel, 'throughput': r['throughput'],
+                         'latency': r['latency'], **accuracy(dets, reference, truth)})
+    return rows
+
+
+def compare(results, baseline, tolerance=0.1):
+    # Prints the change against a baseline run, returns False if any throughput regressed beyond tolerance
+    def key(r):
+        return r.get('precision', 'fp32'), r['batch_size'], r['threads']
+
+    old = {key(r): r for r in baseline['results']}
+    ok = True
+    print(f"{'mode':>8}{'batch':>6}{'threads':>8}{'img/s':>10}{'base':>10}{'change':>9}{'p95 ms':>10}{'base':>10}")
+    for r in results:
+        b = old.get(key(r))
+        if b is None:
+            continue
+        change = r['throughput'] / b['throughput'] - 1
+        ok &= change >= -tolerance
+        print(f"{key(r)[0]:>8}{r['batch_size']:>6}{r['threads']:>8}{r['throughput']:>10}{b['throughput']:>10}"
+              f"{change:>+9.1%}{r['latency']['p95']:>10}{b['latency']['p95']:>10}")
+    return ok
+
+
+def run(weights='models/kd_mod_med.pt',  # models.pt path
+        source=None,  # directory or glob of pictures
+        synthetic=32,  # number of synthetic pictures if no source
+        batch_sizes=(1, 4, 8),  # batch sizes to benchmark
+        threads=(torch.get_num_threads(),),  # torch thread counts to benchmark
+        repeats=3,  # passes over the corpus per configuration
+        device='cpu',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        precisions=('fp32',),  # precision modes to benchmark, the first one is the accuracy reference
+        calibration='pictures/images/train',  # static int8 calibration pictures
+        labels=None,  # YOLO label directory of the source pictures, for accuracy against ground truth
+        staging=False,  # also compare fresh input tensors per batch with the reused staging buffers
+        ensemble=False,  # also compare ensemble fusions and sequential/parallel members, needs several weights
+        tta=False,  # also compare plain inference with sequential and batched test-time augmentation
+        max_tiles=0,  # also compare generic NMS with Kingdomino-aware NMS at this tile budget
+        output=None,  # JSON results file
+        baseline=None,  # JSON results file of a previous run to compare with
+        tolerance=0.1,  # allowed throughput regression against baseline
+        ):
+    corpus = load_corpus(source) if source else list(synthetic_corpus(synthetic))
+    truth = load_labels(corpus, labels) if labels else None
+    results, accuracies, reference = [], {}, None
+    for precision in precisions:
+        detector = get_detector(weights, device=device, precision=precision, calibration=calibration)
+        for t in threads:
+            for b in batch_sizes:
+                r = run_config(detector, corpus, b, t, repeats)
+                results.append(r)
+                print(f"{precision:>7}  batch {b:>3}  threads {t:>3}  {r['throughput']:>8} img/s  "
+                      f"p50 {r['latency']['p50']:>8} ms  p95 {r['latency']['p95']:>8} ms  "
+                      f"p99 {r['latency']['p99']:>8} ms  rss {r['peak_rss']} MB")
+
+        dets = detector.predict([decode(data) for _, data in corpus])
+        accuracies[precision] = accuracy(dets, reference if reference is not None else dets, truth)
+        reference = dets if reference is None else reference
+        print(f'{precision:>7}  accuracy {accuracies[precision]}')
+
+    stagings = compare_staging(detector, corpus, batch_sizes[-1], repeats) if staging else []
+    for r in stagings:
+        print(f"staging reuse {r['reuse']:d}  {r['throughput']:>8} img/s  tensor {r['tensor']} ms  "
+              f"{r['allocations']:>5} allocations  {r['allocated']} MB/image  rss {r['peak_rss']} MB")
+
+    augmentations = compare_tta(weights, corpus, truth, device, batch_sizes[0], repeats) if tta else []
+    for r in augmentations:
+        acc = {k: v for k, v in r.items() if k not in ('augment', 'throughput', 'latency')}
+        print(f"tta {r['augment']:>10}  {r['throughput']:>8} img/s  p50 {r['latency']['p50']:>8} ms  accuracy {acc}")
+
+    ensembles = compare_ensemble(weights, corpus, truth, device, batch_sizes[0], repeats) if ensemble else []
+    for r in ensembles:
+        acc = {k: v for k, v in r.items() if k not in ('fusion', 'parallel', 'throughput', 'latency')}
+        print(f"ensemble {r['fusion']:>4}  parallel {r['parallel']:d}  {r['throughput']:>8} img/s  "
+              f"p50 {r['latency']['p50']:>8} ms  accuracy {acc}")
+
+    nms = []
+    if max_tiles:
+        for b in batch_sizes:
+            nms.append(compare_nms(detector, corpus, b, max_tiles))
+            print(f"nms  batch {b:>3}  generic {nms[-1]['generic']} ms  tiles {nms[-1]['tiles']} ms  "
+                  f"speedup {nms[-1]['speedup']}x  unchanged {nms[-1]['unchanged']:.1%}")
+
+    report = {'host': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+                       'python': platform.python_version(), 'torch': torch.__version__},
+              'weights': str(weights),
+              'source': str(source) if source else f'synthetic {synthetic}',
+              'results': results,
+              'accuracy': accuracies,
+              'staging': stagings,
+              'tta': augmentations,
+              'ensemble': ensembles,
+              'nms': nms}
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+    if baseline:
+        return compare(results, json.loads(Path(baseline).read_text()), tolerance)
+    return True
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', nargs='+', type=str, default=['models/kd_mod_med.pt'], help='models path(s)')
+    parser.add_argument('--source', type=str, default=None, help='directory or glob of pictures')
+    parser.add_argument('--synthetic', type=int, default=32, help='number of synthetic pictures if no --source')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8], help='batch sizes')
+    parser.add_argument('--threads', nargs='+', type=int, default=[torch.get_num_threads()], help='torch threads')
+    parser.add_argument('--repeats', type=int, default=3, help='passes over the corpus per configuration')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--precisions', nargs='+', default=['fp32'], help='fp32, bf16, dynamic and/or static')
+    parser.add_argument('--calibration', type=str, default='pictures/images/train', help='static int8 calibration')
+    parser.add_argument('--labels', type=str, default=None, help='label directory of --source for accuracy')
+    parser.add_argument('--staging', action='store_true', help='compare fresh and reused input tensors')
+    parser.add_argument('--ensemble', action='store_true', help='compare ensemble fusions of several --weights')
+    parser.add_argument('--tta', action='store_true', help='compare sequential and batched test-time augmentation')
+    parser.add_argument('--max-tiles', type=int, default=0, help='compare generic NMS with tile NMS at this budget')
+    parser.add_argument('--output', type=str, default=None, help='write results JSON here')
+    parser.add_argument('--baseline', type=str, default=None, help='results JSON of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed throughput regression vs baseline')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    opt.weights = opt.weights[0] if len(opt.weights) == 1 else opt.weights
+    sys.exit(0 if run(**vars(opt)) else 1)
@@ -3,26 +3,31 @@ import json
 from KingdominoBoard import KingdominoBoard
 from Tile import Tile
 
-# send image file
+# send image file, the server builds and scores the board
 filename = input("enter image filepath: ")
-response = requests.post("http://127.0.0.1:5000/file", files={'picture': open(filename, 'rb')})
+response = requests.post("http://127.0.0.1:5000/file", files={'picture': open(filename, 'rb')}, data={'score': 1})
 
-# get list of detections
+# get scored board
 dictionary = json.loads(response.text)
-detections = dictionary['labels'].split(',')
+if 'board' in dictionary:
+    board = dictionary['board']
+elif dictionary['labels']:  # server without server-side scoring, build the board from the labels
+    with open("classes.txt") as file:
+        labels = file.read().split("\n")
+    tiles = []
+    for tile in dictionary['labels'].split(','):
+        key, x_mid, y_mid, width, height = tile.split(" ")
+        tiles.append(Tile(labels[int(key)], x_mid, y_mid, width, height))
+    board = KingdominoBoard(tiles).to_dict()
+else:
+    board = None
+if board is None:
+    print("no tiles detected")
+    exit()
 
-# get map of detection to tile name
-with open("classes.txt") as file:
-    labels = file.read().split("\n")
-
-tiles = []
-for tile in detections:
-    key, x_mid, y_mid, width, height = tile.split(" ")
-    tiles.append(Tile(labels[int(key)], x_mid, y_mid, width, height))
-
-board = KingdominoBoard(tiles)
-x_dim, y_dim = board.get_dimensions()
+x_dim, y_dim = board['dimensions']
 print("\n-----------------\nBoard Dimensions\n-----------------\n", x_dim, "x", y_dim)
-print("\n-------------\nBoard Values\n-------------\n" + board.display_tiles())
-print("\n-------------\nBoard Scores\n-------------\n" + board.display_scores())
-print("\n------------\nFinal Score\n------------\n", board.get_score(), "\n\n")
+print("\n-------------\nBoard Values\n-------------\n" + "\n".join("\t".join(row) for row in board['tiles']))
+print("\n-------------\nBoard Scores\n-------------\n" +
+      "\n".join("\t".join(str(score) for score in row) for row in board['scores']))
+print("\n------------\nFinal Score\n------------\n", board['total'], "\n\n")
@@ -0,0 +1,221 @@
+"""
+Latency and throughput metrics of the inference server, rendered in the
+Prometheus text exposition format by the /metrics endpoint
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # seconds
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)  # images
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"')) for k, v in pairs) + '}'
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else '%r' % float(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic count, optionally per label values.
+
+    ...
+
+    Methods
+    -------
+    inc(*labels, amount=1)
+        Adds amount to the count of labels
+    set_function(function)
+        Reads the counts from function() when rendered, as {labels: count}
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        """
+        Parameters
+        ----------
+        name : str
+            the metric name
+        help : str
+            the metric description
+        labelnames : tuple of str, default=()
+            names of the labels every sample carries
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> value
+        self._function = None
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """ Adds amount to the count of labels """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_function(self, function):
+        """ Reads the values from function() when rendered, as {label values: value} or a single value """
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            values = self._function()
+            values = values if isinstance(values, dict) else {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [(self.name, labels, value) for labels, value in sorted(values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{_labels(self.labelnames, labels)} {_number(value)}')
+        return '\n'.join(lines)
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, optionally per label values.
+
+    ...
+
+    Methods
+    -------
+    set(value, *labels)
+        Sets the value of labels
+    set_function(function)
+        Reads the values from function() when rendered
+    """
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        """ Sets the value of labels """
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Counter):
+    """
+    Distribution of observed values in cumulative buckets, optionally per
+    label values.
+
+    ...
+
+    Methods
+    -------
+    observe(value, *labels)
+        Records a value
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Parameters
+        ----------
+        name : str
+            the metric name
+        help : str
+            the metric description
+        labelnames : tuple of str, default=()
+            names of the labels every sample carries
+        buckets : tuple of float, default=LATENCY_BUCKETS
+            upper bounds of the buckets, +Inf is added
+        """
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        """ Records a value """
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[labels] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {k: (list(v[0]), v[1]) for k, v in self._values.items()}
+        samples = []
+        for labels, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                samples.append((self.name + '_bucket', labels, count, bound))
+            samples.append((self.name + '_sum', labels, total, None))
+            samples.append((self.name + '_count', labels, counts[-1], None))
+        return samples
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value, bound in self.samples():
+            extra = (('le', _number(bound)),) if bound is not None else ()
+            lines.append(f'{name}{_labels(self.labelnames, labels, extra)} {_number(value)}')
+        return '\n'.join(lines)
+
+
+class Registry:
+    """
+    The metrics exposed by one server.
+
+    ...
+
+    Methods
+    -------
+    register(metric)
+        Adds a metric and returns it
+    render()
+        Returns every metric in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """ Adds a metric and returns it """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Returns every metric in the Prometheus text format """
+        return '\n'.join(m.render() for m in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter('kingdomino_requests_total', 'Requests served', ('endpoint',)))
+IMAGES = REGISTRY.register(Counter('kingdomino_images_total', 'Pictures scored', ('endpoint',)))
+STAGE_SECONDS = REGISTRY.register(Histogram('kingdomino_stage_seconds', 'Time spent in each request stage',
+                                            ('stage',)))
+BATCH_SIZE = REGISTRY.register(Histogram('kingdomino_batch_size', 'Images per forward pass', buckets=BATCH_BUCKETS))
+QUEUE_DEPTH = REGISTRY.register(Gauge('kingdomino_queue_depth', 'Images waiting for inference'))
+CACHE_LOOKUPS = REGISTRY.register(Counter('kingdomino_cache_lookups_total', 'Result cache lookups',
+                                          ('cache', 'result')))
+CACHE_SIZE = REGISTRY.register(Gauge('kingdomino_cache_entries', 'Results held in the cache', ('cache',)))
+
+
+def observe_stage(stage, seconds):
+    """ Records the time spent in a request stage """
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+def observe_batch(size):
+    """ Records the number of images in a forward pass """
+    BATCH_SIZE.observe(size)
+
+
+@contextmanager
+def timed(stage):
+    """ Times the enclosed block as a request stage """
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - t)
@@ -3,6 +3,8 @@
 Common modules
 """
 
+import ast
+import json
 import math
 import warnings
 from pathlib import Path
@@ -10,7 +12,10 @@ from pathlib import Path
 import torch
 import torch.nn as nn
 
-from general import check_suffix
+from general import check_requirements, check_suffix
+from torch_utils import bf16_supported, quantize_dynamic, quantize_static
+
+PRECISIONS = 'fp32', 'bf16', 'dynamic', 'static'  # CPU precision modes of DetectMultiBackend
 
 
 def autopad(k, p=None):  # kernel, padding
@@ -262,10 +267,20 @@ class Concat(nn.Module):
 
 class DetectMultiBackend(nn.Module):
     # YOLOv5 MultiBackend class for python inference on various backends
-    def __init__(self, weights='yolov5s.pt', device=None, dnn=False):
+    def __init__(self, weights='yolov5s.pt', device=None, dnn=False, precision='fp32', calibration=None, ncalib=32,
+                 intra_threads=0, inter_threads=0, fusion='nms', parallel=False):
         # Usage:
-        #   PyTorch:      weights = *.pt
-        from experimental import attempt_download, attempt_load  # scoped to avoid circular import
+        #   PyTorch:      weights = *.pt, or a list of them for an Ensemble fused by fusion ('nms', 'mean' or 'max')
+        #                 with its members run concurrently if parallel
+        #   TorchScript:            *.torchscript, as frozen by export.py
+        #   ONNX Runtime: *.onnx, intra_threads/inter_threads threads per operator/between operators, 0 for default
+        # Precision (CPU, PyTorch):
+        #   fp32:         default
+        #   bf16:         bfloat16 autocast, falls back to fp32 on CPUs without native bf16
+        #   dynamic:      dynamic int8 quantization of Linear layers
+        #   static:       static int8 quantization of fused Conv layers, calibrated on ncalib calibration images
+        from experimental import Ensemble, attempt_download, attempt_load  # scoped to avoid circular import
+        from helpers import LoadImages
 
         super().__init__()
         w = str(weights[0] if isinstance(weights, list) else weights)
@@ -274,17 +289,81 @@ class DetectMultiBackend(nn.Module):
         check_suffix(w, suffixes)  # check weights have acceptable suffix
         pt, jit, onnx, engine, tflite, pb, saved_model, coreml = (suffix == x for x in suffixes)  # backend booleans
         stride, names = 64, [f'class{i}' for i in range(1000)]  # assign defaults
+        export_shape = None  # (height, width) an exported models was traced at, it only runs at that shape
         w = attempt_download(w)  # download if not local
-
-        model = attempt_load(weights if isinstance(weights, list) else w, map_location=device)
-        stride = int(model.stride.max())  # models stride
-        names = model.module.names if hasattr(model, 'module') else model.names  # get class names
-        self.model = model  # explicitly assign for to(), cpu(), cuda(), half()
+        assert precision in PRECISIONS, f'precision {precision} not in {PRECISIONS}'
+        if precision != 'fp32':
+            assert pt, f'{precision} precision is PyTorch only'
+            assert device is None or torch.device(device).type == 'cpu', f'{precision} precision is CPU only'
+
+        if pt:  # PyTorch
+            model = attempt_load(weights if isinstance(weights, list) else w, map_location=device)
+            stride = int(model.stride.max())  # models stride
+            names = model.module.names if hasattr(model, 'module') else model.names  # get class names
+            if isinstance(model, Ensemble):
+                model.fusion = fusion
+                if parallel:
+                    model.parallel()
+
+            if precision == 'bf16' and not bf16_supported():
+                print('WARNING: CPU has no native bfloat16 support, using fp32')
+                precision = 'fp32'
+            elif precision == 'dynamic' and not any(isinstance(m, nn.Linear) for m in model.modules()):
+                print('WARNING: models have no Linear layers for dynamic int8 quantization, using fp32')
+                precision = 'fp32'
+            elif precision == 'dynamic':
+                model = quantize_dynamic(model)
+            elif precision == 'static':
+                assert calibration, 'static int8 quantization needs calibration images'
+                dataset = LoadImages(calibration, img_size=640, stride=stride, auto=False)
+                model = quantize_static(model, (torch.from_numpy(im)[None].float() / 255
+                                                for _, (_, im, *_) in zip(range(ncalib), dataset)))
+            self.model = model  # explicitly assign for to(), cpu(), cuda(), half()
+        elif jit:  # TorchScript
+            print(f'Loading {w} for TorchScript inference...')
+            extra_files = {'config.txt': ''}  # models metadata
+            model = torch.jit.load(w, _extra_files=extra_files, map_location=device)
+            if extra_files['config.txt']:
+                d = json.loads(extra_files['config.txt'])  # extra_files dict
+                stride, names = int(d['stride']), d['names']
+                export_shape = tuple(d['shape'][2:]) if 'shape' in d else None  # traced grids are fixed
+            self.model = model
+        elif onnx:  # ONNX Runtime
+            print(f'Loading {w} for ONNX Runtime inference...')
+            check_requirements(('onnxruntime',))
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads, options.inter_op_num_threads = intra_threads, inter_threads
+            if inter_threads:
+                options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL  # inter-op threads need it
+            session = onnxruntime.InferenceSession(w, options, providers=['CPUExecutionProvider'])
+            meta = session.get_modelmeta().custom_metadata_map  # written by export.py
+            if 'stride' in meta:
+                stride, names = int(meta['stride']), ast.literal_eval(meta['names'])
+            input_name, output_name = session.get_inputs()[0].name, session.get_outputs()[0].name
+            height, width = session.get_inputs()[0].shape[2:]  # names of dynamic axes, sizes otherwise
+            if isinstance(height, int) and isinstance(width, int):  # exported without --dynamic
+                export_shape = height, width
+        else:
+            raise NotImplementedError(f'ERROR: {w} is not a supported format')
         self.__dict__.update(locals())  # assign all variables to self
 
     def forward(self, im, augment=False, visualize=False, val=False):
         # YOLOv5 MultiBackend inference
-        y = self.model(im, augment=augment, visualize=visualize)
+        if self.jit:  # TorchScript, exported with the decoded output only
+            y = self.model(im)[0]
+            return (y, []) if val else y
+        if self.onnx:  # ONNX Runtime
+            y = self.session.run([self.output_name], {self.input_name: im.cpu().numpy()})[0]
+            y = torch.from_numpy(y)
+            return (y, []) if val else y
+        if self.precision == 'bf16':
+            with torch.autocast('cpu', dtype=torch.bfloat16):
+                y = self.model(im, augment=augment, visualize=visualize)
+            y = (y[0].float(), *y[1:])  # NMS and coordinate scaling in fp32
+        else:
+            y = self.model(im, augment=augment, visualize=visualize)
         return y if val else y[0]
 
     def warmup(self, imgsz=(1, 3, 640, 640), half=False):
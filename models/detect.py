@@ -25,10 +25,10 @@ if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))  # add ROOT to PATH
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
-from common import DetectMultiBackend
-from helpers import LoadImages
-from general import (check_img_size, check_requirements, increment_path, non_max_suppression, scale_coords, xyxy2xywh)
-from torch_utils import select_device
+from detector import get_detector, read_profile, save_labels
+from helpers import LoadImages, LoadImagesPrefetch
+from general import check_img_size, check_requirements, increment_path
+from torch_utils import time_sync
 
 
 @torch.no_grad()
@@ -42,6 +42,15 @@ def run(weights=ROOT / 'models/kd_mod_med.pt',  # models.pt path(s)
         project=ROOT / 'receive',  # save results to project/name
         name='',  # save results to project/name
         exist_ok=True,  # existing project/name ok, do not increment
+        workers=0,  # image loader threads, 0 to load serially on the inference thread
+        batch_size=1,  # images per forward pass with a threaded loader
+        prefetch=2,  # batches the threaded loader keeps ahead of inference
+        buffer=False,  # threaded loader writes batches into preallocated arrays
+        augment=False,  # augmented inference, 'batched' to run all augmented views in one forward pass
+        fusion='nms',  # ensemble fusion of several weights: nms, mean or max
+        parallel=False,  # run ensemble members concurrently with split thread budgets
+        max_tiles=0,  # Kingdomino-aware NMS with this tile budget (49 or 81), 0 for generic NMS
+        profile=None,  # autotune.py profile of this host, sets torch threads and memory format
         ):
     source = str(source)
 
@@ -49,54 +58,56 @@ def run(weights=ROOT / 'models/kd_mod_med.pt',  # models.pt path(s)
     save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
     save_dir.mkdir(parents=True, exist_ok=True)  # make dir
 
-    # Load models
-    device = select_device(device)
-    model = DetectMultiBackend(weights, device=device)
-    stride, names, pt = model.stride, model.names, model.pt
+    # Load models (resident after the first call)
+    model = get_detector(weights, device=device, imgsz=imgsz, max_tiles=max_tiles, fusion=fusion, parallel=parallel)
+    device, stride, names, pt = model.device, model.stride, model.names, model.pt
     imgsz = check_img_size(imgsz, s=stride)  # check image size
-    model.model.float()
+    if profile:
+        tuning = read_profile(profile)
+        model.configure(tuning.get('threads'), tuning.get('channels_last'))
 
-    dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt)
+    if workers:
+        dataset = LoadImagesPrefetch(source, img_size=imgsz, stride=stride, auto=pt, batch_size=batch_size,
+                                     workers=workers, prefetch=prefetch, buffer=buffer)
+    else:
+        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt)
 
     # Run inference
-    model.warmup(imgsz=(1, 3, *imgsz), half=False)  # warmup
     dt, seen = [0.0, 0.0, 0.0], 0
     for path, im, im0s, vid_cap, s in dataset:
-        im = torch.from_numpy(im).to(device)
-        im = im.float()  # uint8 to fp16/32
-        im /= 255  # 0 - 255 to 0.0 - 1.0
-        if len(im.shape) == 3:
-            im = im[None]  # expand for batch dim
+        t1 = time_sync()
+        im = model.staging.put(im, hwc=False)  # uint8 to 0.0 - 1.0 fp32 BCHW in a reused tensor
+        t2 = time_sync()
+        dt[0] += t2 - t1
 
         # Inference
-        pred = model(im, augment=False, visualize=False)
+        try:
+            pred = model(im, augment=augment, visualize=False)
+        finally:
+            model.staging.release(im)
+        t3 = time_sync()
+        dt[1] += t3 - t2
 
         # NMS
-        pred = non_max_suppression(pred, conf_thres, iou_thres, None, False, max_det=max_det)
+        pred = model.nms(pred, conf_thres, iou_thres, max_det)  # tile_nms if max_tiles
+        dt[2] += time_sync() - t3
 
         # Process predictions
         for i, det in enumerate(pred):  # per image
             seen += 1
-            p, im0, frame = path, im0s.copy(), getattr(dataset, 'frame', 0)
+            p, im0 = (path[i], im0s[i]) if workers else (path, im0s)  # batch_size >= 1 with workers, im0 only read
 
             p = Path(p)  # to Path
             txt_path = str(save_dir / p.stem)  # im.txt
             s += '%gx%g ' % im.shape[2:]  # print string
-            gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
-            with open(txt_path + '.txt', 'w') as f:
-                f.write("")
-            if len(det):
-                # Rescale boxes from img_size to im0 size
-                det[:, :4] = scale_coords(im.shape[2:], det[:, :4], im0.shape).round()
-
-                # Write results
-                if os.path.exists(txt_path + '.txt'):
-                    os.remove(txt_path + '.txt')
-                for *xyxy, conf, cls in reversed(det):
-                    xywh = (xyxy2xywh(torch.tensor(xyxy).view(1, 4)) / gn).view(-1).tolist()  # normalized xywh
-                    line = (cls, *xywh)  # label format
-                    with open(txt_path + '.txt', 'a') as f:
-                        f.write(('%g ' * len(line)).rstrip() % line + '\n')
+
+            # Rescale, convert and normalize all boxes at once, then write the label file in one go
+            save_labels(model.postprocess(det, im.shape[2:], im0.shape), txt_path + '.txt')
+
+    # Print results
+    if seen:
+        t = tuple(x / seen * 1E3 for x in dt)  # speeds per image
+        print(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
 
 
 def parse_opt():
@@ -111,6 +122,15 @@ def parse_opt():
     parser.add_argument('--project', default=ROOT / 'runs/detect', help='save results to project/name')
     parser.add_argument('--name', default='exp', help='save results to project/name')
     parser.add_argument('--exist-ok', action='store_true', help='existing project/name ok, do not increment')
+    parser.add_argument('--workers', type=int, default=0, help='image loader threads, 0 to load serially')
+    parser.add_argument('--batch-size', type=int, default=1, help='images per forward pass with --workers')
+    parser.add_argument('--prefetch', type=int, default=2, help='batches loaded ahead of inference with --workers')
+    parser.add_argument('--augment', nargs='?', const=True, default=False, help='augmented inference, or: batched')
+    parser.add_argument('--fusion', default='nms', help='ensemble fusion of several --weights: nms, mean or max')
+    parser.add_argument('--parallel', action='store_true', help='run ensemble members concurrently')
+    parser.add_argument('--max-tiles', type=int, default=0, help='Kingdomino-aware NMS tile budget, 0 for generic')
+    parser.add_argument('--profile', type=str, default=None, help='autotune.py profile, i.e. autotune.json')
+    parser.add_argument('--buffer', action='store_true', help='load batches into preallocated arrays with --workers')
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     return opt
@@ -0,0 +1,256 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Resident detector registry, loads and fuses each model once per process and reuses it between requests
+
+Usage:
+    from detector import get_detector
+    detector = get_detector('models/kd_mod_med.pt', device='cpu')
+    dets = detector.predict([im0, im1])  # list of (n,6) [cls, x, y, w, h, conf] arrays
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from common import DetectMultiBackend
+from general import check_img_size, non_max_suppression, scale_coords, tile_nms, xyxy2xywh
+from helpers import StagingPool, letterbox
+from torch_utils import select_device, time_sync
+
+_detectors = {}  # (weights, device, precision, imgsz, max_tiles, augment, fusion, parallel) -> Detector
+_lock = threading.Lock()
+
+
+class Detector:
+    # Loaded, fused and warmed up YOLOv5 models, kept resident between inference calls
+    def __init__(self, weights, device='', imgsz=(640, 640), precision='fp32', calibration=None, intra_threads=0,
+                 inter_threads=0, max_tiles=0, augment=False, fusion='nms', parallel=False):
+        t = time_sync()
+        self.weights = weights
+        self.device = select_device(device)
+        self.model = DetectMultiBackend(weights, device=self.device, precision=precision, calibration=calibration,
+                                        intra_threads=intra_threads, inter_threads=inter_threads, fusion=fusion,
+                                        parallel=parallel)
+        self.stride, self.names, self.pt = self.model.stride, self.model.names, self.model.pt
+        self.precision = self.model.precision  # bf16 falls back to fp32 on CPUs without native support
+        self.imgsz = check_img_size(imgsz, s=self.stride)  # check image size
+        if self.model.export_shape and list(self.model.export_shape) != self.imgsz:  # exported grids are fixed
+            print(f'WARNING: {weights} was exported at {self.model.export_shape}, using it instead of {self.imgsz}')
+            self.imgsz = list(self.model.export_shape)
+        self.model.warmup(imgsz=(1, 3, *self.imgsz), half=False)  # warmup
+        self.load_time = time_sync() - t  # seconds
+        self.memory = self.model_bytes()
+        self.max_tiles = max_tiles  # tile budget of a kingdom for tile_nms, 0 for generic NMS
+        self.augment = augment  # test-time augmentation, True for one forward pass per view or 'batched' for one in all
+        self.channels_last = False  # NHWC memory format for models and inputs, see configure()
+        self.staging = StagingPool(self.device)  # reused input tensors
+        self.warmed, self.warmup_time = False, 0.0  # see warmup()
+        self.on_stage = None  # optional callback(stage, seconds) for per-stage latency metrics
+        self.on_batch = None  # optional callback(batch size) called for every forward pass
+
+    def model_bytes(self):
+        # Bytes of weights and buffers, int8 packed weights included, or the file size of a non-PyTorch models
+        if not self.pt:
+            return Path(self.model.w).stat().st_size
+        return sum(x.numel() * x.element_size() for v in self.model.state_dict().values()
+                   for x in (v if isinstance(v, tuple) else (v,)) if isinstance(x, torch.Tensor))
+
+    @torch.no_grad()
+    def warmup(self, batch_sizes=(1,), shapes=None):
+        # Runs a dummy batch of every batch size and letterboxed (height, width) shape, default imgsz, through the
+        # forward pass and NMS so first requests do not pay for allocator growth, oneDNN primitive creation and
+        # Detect grid construction. Sets warmed once done, returns the seconds it took
+        t = time_sync()
+        for shape in shapes or [self.imgsz]:
+            for b in sorted(batch_sizes, reverse=True):  # the largest staging buffer serves the smaller batches
+                im = self.staging.put(np.zeros((b, 3, *shape), dtype=np.uint8), hwc=False)
+                try:
+                    self.nms(self.model(im, augment=self.augment))
+                finally:
+                    self.staging.release(im)
+        self.warmup_time = time_sync() - t
+        self.warmed = True
+        return self.warmup_time
+
+    def configure(self, threads=None, channels_last=None):
+        # Applies host tuning (e.g. an autotune.py profile): torch intra-op threads and NHWC memory format
+        if threads:
+            torch.set_num_threads(threads)
+            if self.pt and getattr(self.model.model, 'executor', None) is not None:  # parallel ensemble
+                self.model.model.parallel(threads)  # split the new count between the members
+        if channels_last is not None and self.pt:
+            self.channels_last = self.staging.channels_last = channels_last
+            self.model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+
+    def __call__(self, im, augment=False, visualize=False):
+        return self.model(im, augment=augment, visualize=visualize)
+
+    @contextmanager
+    def stage(self, name):
+        # Times the enclosed block and reports it to on_stage
+        if self.on_stage is None:
+            yield
+            return
+        t = time_sync()
+        yield
+        self.on_stage(name, time_sync() - t)
+
+    def letterbox_shape(self, shape):
+        # (height, width) preprocess() letterboxes an image of shape to: the longest side scaled to imgsz and, for
+        # PyTorch models, the other one padded to the next stride multiple only (rectangular inference)
+        if not self.pt:  # exported models have a fixed input shape
+            return tuple(self.imgsz)
+        r = min(self.imgsz[0] / shape[0], self.imgsz[1] / shape[1])
+        return tuple(-(-int(round(x * r)) // self.stride) * self.stride for x in shape[:2])
+
+    def rect_shapes(self, ratios=(4 / 3, 16 / 9)):
+        # Letterboxed shapes of landscape and portrait pictures of the given aspect ratios (phone cameras), and
+        # the square imgsz, e.g. to warm up rectangular inference
+        shapes = [tuple(self.imgsz)]
+        for ratio in ratios:
+            for shape in ((1, ratio), (ratio, 1)):
+                s = self.letterbox_shape(shape)
+                shapes += [s] if s not in shapes else []
+        return shapes
+
+    def preprocess(self, im0):
+        # Letterbox a BGR HWC image (as returned by cv2.imread), returned as is if it already has the letterboxed shape
+        # (e.g. resized and padded by load_picture), infer() stages it into a reused input tensor
+        with self.stage('letterbox'):
+            if im0.shape[:2] == self.letterbox_shape(im0.shape):
+                return im0
+            return letterbox(np.ascontiguousarray(im0), self.imgsz, stride=self.stride, auto=self.pt)[0]
+
+    @staticmethod
+    def postprocess(det, shape, im0_shape):
+        # Rescale (n,6) [xyxy, conf, cls] detections from inference shape to im0 and return a (n,6) float32 array of
+        # [cls, x, y, w, h, conf] rows, xywh normalized to im0, in the same order detect.py writes its label files
+        if not len(det):
+            return np.zeros((0, 6), dtype=np.float32)
+        det = det.clone()
+        det[:, :4] = scale_coords(shape, det[:, :4], im0_shape).round()
+        gn = torch.tensor(im0_shape, device=det.device)[[1, 0, 1, 0]]  # normalization gain whwh
+        xywh = xyxy2xywh(det[:, :4]) / gn  # normalized xywh
+        return torch.cat((det[:, 5:6], xywh, det[:, 4:5]), 1).flip(0).cpu().numpy()  # label format + conf
+
+    @torch.no_grad()
+    def infer(self, ims, im0_shapes, conf_thres=0.5, iou_thres=0.45, max_det=1000):
+        # Runs same-shape letterboxed BGR HWC images through the models in a single forward pass,
+        # returns a (n,6) [cls, x, y, w, h, conf] array per image
+        with self.stage('tensor'):
+            im = self.staging.put(ims)
+        try:
+            return self.infer_tensor(im, im0_shapes, conf_thres, iou_thres, max_det)
+        finally:
+            self.staging.release(im)
+
+    def nms(self, pred, conf_thres=0.5, iou_thres=0.45, max_det=1000):
+        # Generic YOLOv5 NMS, or Kingdomino-aware tile_nms if a tile budget is set
+        if self.max_tiles:
+            return tile_nms(pred, conf_thres, iou_thres, max_tiles=min(self.max_tiles, max_det))
+        return non_max_suppression(pred, conf_thres, iou_thres, None, False, max_det=max_det)
+
+    @torch.no_grad()
+    def infer_tensor(self, im, im0_shapes, conf_thres=0.5, iou_thres=0.45, max_det=1000):
+        # Runs a normalized BCHW tensor through the models, returns a (n,6) [cls, x, y, w, h, conf] array per image
+        if self.on_batch is not None:
+            self.on_batch(len(im))
+        with self.stage('forward'):
+            pred = self.model(im, augment=self.augment, visualize=False)
+        with self.stage('nms'):
+            pred = self.nms(pred, conf_thres, iou_thres, max_det)
+        with self.stage('scale'):
+            return [self.postprocess(det, im.shape[2:], s) for det, s in zip(pred, im0_shapes)]
+
+    def predict(self, images, conf_thres=0.5, iou_thres=0.45, max_det=1000, batch_size=8):
+        # Detections of one or more images as a list of (n,6) float32 [cls, x, y, w, h, conf] arrays, one per image,
+        # xywh normalized to the image. images is a BGR HWC uint8 array, a BHWC array or a list of HWC arrays,
+        # or an already letterboxed RGB CHW/BCHW tensor (uint8, or float in 0-1) whose own shape is the image shape
+        if isinstance(images, torch.Tensor):
+            im = (images[None] if images.ndim == 3 else images).to(self.device)
+            im = im.float() / 255 if not im.is_floating_point() else im.float()
+            im0_shapes = [(*im.shape[2:], im.shape[1])] * len(im)
+            return self.infer_tensor(im, im0_shapes, conf_thres, iou_thres, max_det)
+        if isinstance(images, np.ndarray) and images.ndim == 3:
+            images = [images]
+        return self.detect_batch(list(images), conf_thres, iou_thres, max_det, batch_size)
+
+    def detect(self, im0, conf_thres=0.5, iou_thres=0.45, max_det=1000):
+        # Runs a single in-memory BGR HWC image through the models, returns its (n,6) [cls, x, y, w, h, conf] array
+        return self.infer([self.preprocess(im0)], [im0.shape], conf_thres, iou_thres, max_det)[0]
+
+    def detect_batch(self, im0s, conf_thres=0.5, iou_thres=0.45, max_det=1000, batch_size=8):
+        # Runs in-memory BGR HWC images through the models in batches of same-shape images,
+        # returns a (n,6) [cls, x, y, w, h, conf] array per image in input order
+        ims = [self.preprocess(im0) for im0 in im0s]
+        shapes = {}  # letterboxed shape -> image indices
+        for i, im in enumerate(ims):
+            shapes.setdefault(im.shape, []).append(i)
+
+        results = [None] * len(ims)
+        for indices in shapes.values():
+            for j in range(0, len(indices), batch_size):
+                batch = indices[j:j + batch_size]
+                dets = self.infer([ims[i] for i in batch], [im0s[i].shape for i in batch], conf_thres, iou_thres,
+                                  max_det)
+                for i, det in zip(batch, dets):
+                    results[i] = det
+        return results
+
+    def info(self):
+        # Load time and memory footprint of the resident models
+        return {'weights': [str(w) for w in self.weights] if isinstance(self.weights, list) else str(self.weights),
+                'device': str(self.device),
+                'precision': self.precision,
+                'load_time': round(self.load_time, 3),  # seconds
+                'warmup_time': round(self.warmup_time, 3) if self.warmed else None,  # seconds
+                'memory': round(self.memory / 1E6, 2)}  # MB of parameters and buffers
+
+
+def save_labels(det, path):
+    # Writes (n,6) [cls, x, y, w, h, conf] detections to a YOLO label file with a single buffered write
+    np.savetxt(path, np.asarray(det).reshape(-1, 6)[:, :5], fmt='%g', delimiter=' ')
+
+
+def read_profile(path='autotune.json'):
+    # Returns the autotune.py profile at path, or an empty dict if there is none or it was tuned on another host
+    path = Path(path)
+    if not path.is_file():
+        return {}
+    profile = json.loads(path.read_text())
+    if profile.get('cpus') != os.cpu_count():
+        print(f"WARNING: {path} was tuned for {profile.get('cpus')} CPUs, this host has {os.cpu_count()}, ignoring it")
+        return {}
+    return profile
+
+
+def _registry_key(weights, device, precision='fp32', imgsz=(640, 640), max_tiles=0, augment=False, fusion='nms',
+                  parallel=False):
+    w = tuple(str(Path(x).resolve()) for x in weights) if isinstance(weights, list) else str(Path(weights).resolve())
+    imgsz = tuple(imgsz) if isinstance(imgsz, (list, tuple)) else (imgsz, imgsz)
+    return w, str(device).strip().lower().replace('cuda:', ''), precision, imgsz, max_tiles, augment, fusion, parallel
+
+
+def get_detector(weights, device='', imgsz=(640, 640), precision='fp32', calibration=None, intra_threads=0,
+                 inter_threads=0, max_tiles=0, augment=False, fusion='nms', parallel=False):
+    # Returns the resident Detector for weights on device at precision, loading it on first use.
+    # ONNX Runtime thread counts only apply to .onnx weights and only when they are first loaded
+    key = _registry_key(weights, device, precision, imgsz, max_tiles, augment, fusion, parallel)
+    with _lock:  # concurrent first requests load the models only once
+        if key not in _detectors:
+            _detectors[key] = Detector(weights, device=device, imgsz=imgsz, precision=precision,
+                                       calibration=calibration, intra_threads=intra_threads,
+                                       inter_threads=inter_threads, max_tiles=max_tiles, augment=augment,
+                                       fusion=fusion, parallel=parallel)
+        return _detectors[key]
+
+
+def loaded_detectors():
+    # Returns load time and memory of every resident models
+    with _lock:
+        return [d.info() for d in _detectors.values()]
@@ -3,6 +3,7 @@
 Experimental modules
 """
 import math
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import torch
@@ -72,18 +73,58 @@ class MixConv2d(nn.Module):
         return self.act(self.bn(torch.cat([m(x) for m in self.m], 1)))
 
 
+def _forward_member(module, grad, autocast, x, augment, profile, visualize):
+    # Runs an ensemble member on a pool thread with the grad and autocast modes of the calling thread (thread-local)
+    with torch.set_grad_enabled(grad), torch.autocast('cpu', dtype=torch.get_autocast_cpu_dtype(), enabled=autocast):
+        return module(x, augment, profile, visualize)[0]
+
+
 class Ensemble(nn.ModuleList):
-    # Ensemble of models
+    # Ensemble of models, fused by 'nms' (outputs concatenated for NMS), 'mean' or 'max' (same-shape outputs only)
+    fusion = 'nms'
+    executor = None  # one thread per member once parallel() is called
+    threads = None  # intra-op threads split between the members
+    _restore = False  # a member thread resized the process-wide thread pools
+
     def __init__(self):
         super().__init__()
 
+    def parallel(self, threads=None):
+        # Runs the members concurrently, each on its own thread with an even share of the intra-op threads, default
+        # the current count. Detector.configure splits again when it changes the count. The share is set per thread,
+        # which the OpenMP backend honours, other backends share one intra-op pool
+        self.threads = threads or torch.get_num_threads()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.executor = ThreadPoolExecutor(len(self), thread_name_prefix='ensemble', initializer=self._member_threads,
+                                           initargs=(max(1, self.threads // len(self)),))
+        return self
+
+    def _member_threads(self, budget):
+        # Pool thread initializer. torch.set_num_threads also resizes process-wide pools (MKL, pthreadpool), which
+        # forward() gives back to the calling thread's count
+        torch.set_num_threads(budget)
+        self._restore = True
+
     def forward(self, x, augment=False, profile=False, visualize=False):
-        y = []
-        for module in self:
-            y.append(module(x, augment, profile, visualize)[0])
-        # y = torch.stack(y).max(0)[0]  # max ensemble
-        # y = torch.stack(y).mean(0)  # mean ensemble
-        y = torch.cat(y, 1)  # nms ensemble
+        if self.executor is not None:  # concurrent members
+            modes = torch.is_grad_enabled(), torch.is_autocast_cpu_enabled()
+            y = [f.result() for f in [self.executor.submit(_forward_member, module, *modes, x, augment, profile,
+                                                           visualize) for module in self]]
+            if self._restore:  # member threads just started, the members keep their per-thread OpenMP share
+                self._restore = False
+                torch.set_num_threads(self.threads)
+        else:
+            y = [module(x, augment, profile, visualize)[0] for module in self]
+
+        if self.fusion in ('mean', 'max'):
+            assert len({t.shape for t in y}) == 1, f'{self.fusion} fusion needs members with the same anchors, strides'
+        if self.fusion == 'max':
+            y = torch.stack(y).max(0)[0]  # max ensemble
+        elif self.fusion == 'mean':
+            y = torch.stack(y).mean(0)  # mean ensemble
+        else:
+            y = torch.cat(y, 1)  # nms ensemble
         return y, None  # inference, train output
 
 
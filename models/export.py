@@ -0,0 +1,166 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Export a fused YOLOv5 PyTorch models to other formats, with the Detect() decode included
+
+Format                  | `--include ...` argument  | Model
+---                     | ---                       | ---
+PyTorch                 | -                         | kd_mod_med.pt
+TorchScript             | `torchscript`             | kd_mod_med.torchscript
+ONNX                    | `onnx`                    | kd_mod_med.onnx
+
+Usage:
+    $ python path/to/export.py --weights models/kd_mod_med.pt --include torchscript onnx
+
+Inference:
+    $ python path/to/detect.py --weights models/kd_mod_med.torchscript
+                                         models/kd_mod_med.onnx
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from experimental import attempt_load
+from general import check_img_size, check_requirements, colorstr
+from torch_utils import select_device
+from yolo import Detect
+
+
+def export_torchscript(model, im, file, optimize, prefix=colorstr('TorchScript:')):
+    # YOLOv5 TorchScript export, traced then frozen so a worker starts with a single load and no Python layer dispatch
+    try:
+        print(f'\n{prefix} starting export with torch {torch.__version__}...')
+        f = file.with_suffix('.torchscript')
+
+        ts = torch.jit.trace(model, im, strict=False)
+        ts = torch.jit.freeze(ts.eval())  # inline weights and attributes as constants
+        if optimize:  # fold conv/add/activation patterns and pick the CPU kernels
+            ts = torch.jit.optimize_for_inference(ts)
+        d = {'shape': im.shape, 'stride': int(max(model.stride)), 'names': model.names}  # read by DetectMultiBackend
+        ts.save(str(f), _extra_files={'config.txt': json.dumps(d)})
+
+        print(f'{prefix} export success, saved as {f} ({f.stat().st_size / 1E6:.1f} MB)')
+        return f
+    except Exception as e:
+        print(f'{prefix} export failure: {e}')
+
+
+def export_onnx(model, im, file, opset, dynamic, prefix=colorstr('ONNX:')):
+    # YOLOv5 ONNX export, the batch axis is always dynamic, height and width too if dynamic
+    try:
+        check_requirements(('onnx',))
+        import onnx
+
+        print(f'\n{prefix} starting export with onnx {onnx.__version__}...')
+        f = file.with_suffix('.onnx')
+
+        axes = {0: 'batch', 2: 'height', 3: 'width'} if dynamic else {0: 'batch'}
+        torch.onnx.export(model, im, f, verbose=False, opset_version=opset,
+                          training=torch.onnx.TrainingMode.EVAL,
+                          do_constant_folding=True,
+                          input_names=['images'],
+                          output_names=['output'],
+                          dynamic_axes={'images': axes,  # shape(b,3,640,640)
+                                        'output': {0: 'batch', 1: 'anchors'}})  # shape(b,25200,85)
+
+        # Checks
+        model_onnx = onnx.load(f)  # load onnx models
+        onnx.checker.check_model(model_onnx)  # check onnx models
+
+        # Metadata, read back by DetectMultiBackend
+        d = {'stride': int(max(model.stride)), 'names': model.names}
+        for k, v in d.items():
+            meta = model_onnx.metadata_props.add()
+            meta.key, meta.value = k, str(v)
+        onnx.save(model_onnx, f)
+
+        print(f'{prefix} export success, saved as {f} ({f.stat().st_size / 1E6:.1f} MB)')
+        return f
+    except Exception as e:
+        print(f'{prefix} export failure: {e}')
+
+
+@torch.no_grad()
+def run(weights=ROOT / 'kd_mod_med.pt',  # weights path
+        imgsz=(640, 640),  # image (height, width)
+        batch_size=1,  # batch size of the example input
+        device='cpu',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        include=('torchscript', 'onnx'),  # include formats
+        optimize=True,  # TorchScript: optimize_for_inference
+        dynamic=False,  # ONNX: dynamic height and width on top of the dynamic batch
+        opset=12,  # ONNX: opset version
+        ):
+    t = time.time()
+    include = [x.lower() for x in include]
+    file = Path(weights)
+
+    # Load PyTorch models
+    device = select_device(device)
+    model = attempt_load(weights, map_location=device, inplace=True, fuse=True)  # load FP32 models
+    names = model.names
+
+    # Input
+    gs = int(max(model.stride))  # grid size (max stride)
+    imgsz = [check_img_size(x, gs) for x in imgsz]  # verify img_size are gs-multiples
+    im = torch.zeros(batch_size, 3, *imgsz).to(device)  # image size(1,3,320,192) BCHW iDetection
+
+    # Update models
+    model.eval()
+    for k, m in model.named_modules():
+        if isinstance(m, Detect):
+            m.onnx_dynamic = dynamic
+            m.export = True  # decoded output only
+
+    for _ in range(2):
+        y = model(im)  # dry runs
+    print(f"\n{colorstr('PyTorch:')} starting from {file} ({file.stat().st_size / 1E6:.1f} MB), "
+          f"{len(names)} classes, output shape {tuple(y[0].shape)}")
+
+    # Exports
+    f = []
+    if 'torchscript' in include:
+        f.append(export_torchscript(model, im, file, optimize))
+    if 'onnx' in include:
+        f.append(export_onnx(model, im, file, opset, dynamic))
+
+    # Finish
+    f = [str(x) for x in f if x]  # filter out '' and None
+    if any(f):
+        print(f'\nExport complete ({time.time() - t:.2f}s)'
+              f"\nResults saved to {colorstr('bold', file.parent.resolve())}"
+              f"\nDetect:          python detect.py --weights {f[-1]}")
+    return f  # return list of exported files/dirs
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default=ROOT / 'kd_mod_med.pt', help='models.pt path')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[640, 640], help='image (h, w)')
+    parser.add_argument('--batch-size', type=int, default=1, help='batch size')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--no-optimize', dest='optimize', action='store_false', help='TorchScript: skip optimization')
+    parser.add_argument('--dynamic', action='store_true', help='ONNX: dynamic height and width axes')
+    parser.add_argument('--opset', type=int, default=12, help='ONNX: opset version')
+    parser.add_argument('--include', nargs='+', default=['torchscript', 'onnx'], help='torchscript, onnx')
+    opt = parser.parse_args()
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
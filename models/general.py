@@ -377,6 +377,33 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
     return output
 
 
+def tile_nms(prediction, conf_thres=0.5, iou_thres=0.45, max_tiles=49, topk=None):
+    """Kingdomino-aware NMS. A kingdom holds at most max_tiles tiles (49 for a 7x7 kingdom, 81 for the 9x9
+    variant), so only the topk (default 16 * max_tiles) candidates with the highest objectness of each image are
+    decoded, all images go through a single batched NMS call and at most max_tiles detections are kept per image
+
+    Returns:
+         list of detections, on (n,6) tensor per image [xyxy, conf, cls]
+    """
+
+    assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
+    assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
+    bs, n, no = prediction.shape
+    nc = no - 5  # number of classes
+
+    # Top-k on objectness before the class scores are multiplied in
+    obj, k = prediction[..., 4].topk(min(topk or 16 * max_tiles, n), dim=1)  # (bs,topk)
+    x = prediction.gather(1, k[..., None].expand(-1, -1, no))  # (bs,topk,no)
+    conf, j = (x[..., 5:] * obj[..., None]).max(2)  # best class, conf = obj_conf * cls_conf
+    b, k = ((obj > conf_thres) & (conf > conf_thres)).nonzero(as_tuple=True)  # image, candidate
+
+    # Batched NMS over all images, boxes only suppress boxes of the same image and class
+    boxes, scores, j = xywh2xyxy(x[b, k, :4]), conf[b, k], j[b, k]
+    i = torchvision.ops.batched_nms(boxes, scores, b * nc + j, iou_thres)  # sorted by decreasing score
+    x, b = torch.cat((boxes[i], scores[i, None], j[i, None].float()), 1), b[i]
+    return [x[b == xi][:max_tiles] for xi in range(bs)]  # tile budget
+
+
 def increment_path(path, exist_ok=False, sep='', mkdir=False):
     # Increment file or directory path, i.e. runs/exp --> runs/exp{sep}2, runs/exp{sep}3, ... etc.
     path = Path(path)  # os-agnostic
@@ -8,7 +8,10 @@ import glob
 import numpy as np
 import os
 import subprocess
+import threading
 import urllib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import requests
@@ -63,19 +66,24 @@ def check_anchor_order(m):
         m.anchors[:] = m.anchors.flip(0)
 
 
+def source_files(path):
+    # Absolute path and sorted files of a file, directory or glob source
+    p = str(Path(path).resolve())  # os-agnostic absolute path
+    if '*' in p:
+        files = sorted(glob.glob(p, recursive=True))  # glob
+    elif os.path.isdir(p):
+        files = sorted(glob.glob(os.path.join(p, '*.*')))  # dir
+    elif os.path.isfile(p):
+        files = [p]  # files
+    else:
+        raise Exception(f'ERROR: {p} does not exist')
+    return p, files
+
+
 class LoadImages:
     # YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`
     def __init__(self, path, img_size=640, stride=32, auto=True):
-        p = str(Path(path).resolve())  # os-agnostic absolute path
-        if '*' in p:
-            files = sorted(glob.glob(p, recursive=True))  # glob
-        elif os.path.isdir(p):
-            files = sorted(glob.glob(os.path.join(p, '*.*')))  # dir
-        elif os.path.isfile(p):
-            files = [p]  # files
-        else:
-            raise Exception(f'ERROR: {p} does not exist')
-
+        p, files = source_files(path)
         images = [x for x in files if x.split('.')[-1].lower() in IMG_FORMATS]
         videos = [x for x in files if x.split('.')[-1].lower() in VID_FORMATS]
         ni, nv = len(images), len(videos)
@@ -145,6 +153,155 @@ class LoadImages:
         return self.nf  # number of files
 
 
+class LoadImagesPrefetch:
+    # Image dataloader that reads and letterboxes ahead of the inference thread on a thread pool, i.e.
+    # `python detect.py --source path/ --workers 4 --batch-size 8`. Yields (paths, ims, im0s, None, s) batches with
+    # ims a contiguous uint8 BCHW RGB array, keeping up to `prefetch` batches decoded or in flight.
+    # Stacked batches need a single shape, so images are padded to the full img_size unless batch_size is 1.
+    # With buffer=True the batches are written into a ring of preallocated arrays, a yielded batch is then only valid
+    # until the next one is requested. The loader threads stop once the files are exhausted, or on close()
+    def __init__(self, path, img_size=640, stride=32, auto=True, batch_size=1, workers=4, prefetch=2, buffer=False):
+        self.pool = None  # loader threads of the current iteration
+        self.pending = deque()  # (paths, futures, buffer) of submitted batches
+        p, files = source_files(path)
+        self.files = [x for x in files if x.split('.')[-1].lower() in IMG_FORMATS]
+        self.nf = len(self.files)  # number of files
+        assert self.nf > 0, f'No images found in {p}. Supported formats are:\nimages: {IMG_FORMATS}'
+
+        self.img_size = (img_size, img_size) if isinstance(img_size, int) else tuple(img_size)
+        self.stride = stride
+        self.batch_size = batch_size
+        self.auto = auto and batch_size == 1 and not buffer  # stacked and preallocated batches need one shape
+        self.prefetch = max(1, prefetch)
+        self.workers = max(1, workers)
+        self.buffers = [np.empty((batch_size, 3, *self.img_size), dtype=np.uint8)
+                        for _ in range(self.prefetch + 1)] if buffer else None  # in flight + being consumed
+
+    def __iter__(self):
+        self.close()  # a previous iteration left early
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='loader')  # cv2 releases the GIL
+        self.count = 0  # images yielded
+        self.submitted = 0  # batches submitted
+        while len(self.pending) < self.prefetch and self._submit():
+            pass
+        return self
+
+    def __next__(self):
+        if not self.pending:
+            self.close()
+            raise StopIteration
+        paths, futures, out = self.pending.popleft()
+        self._submit()  # keep the pool busy while this batch is consumed
+        ims, im0s = zip(*[f.result() for f in futures])
+        ims = out if out is not None else np.stack(ims) if self.batch_size > 1 else ims[0][None]
+        self.count += len(paths)
+        s = f'image {self.count}/{self.nf} {paths[-1]}: '
+        return paths, ims, list(im0s), None, s
+
+    def _submit(self):
+        # Queue the reads of the next batch, returns False once every file is queued
+        i = self.submitted * self.batch_size
+        if i >= self.nf:
+            return False
+        paths = self.files[i:i + self.batch_size]
+        out = self.buffers[self.submitted % len(self.buffers)][:len(paths)] if self.buffers else None
+        futures = [self.pool.submit(self._load, x, None if out is None else out[j]) for j, x in enumerate(paths)]
+        self.pending.append((paths, futures, out))
+        self.submitted += 1
+        return True
+
+    def close(self):
+        # Cancels the queued reads and stops the loader threads, for consumers that stop before the last batch
+        for _, futures, _ in self.pending:
+            for f in futures:
+                f.cancel()
+        self.pending.clear()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)  # no running read may still write into a ring buffer
+            self.pool = None
+
+    def __del__(self):
+        self.close()
+
+    def _load(self, path, out=None):
+        # Read, letterbox and convert one image, into out if given
+        img0 = cv2.imread(path)  # BGR
+        assert img0 is not None, f'Image Not Found {path}'
+        img = letterbox(img0, self.img_size, stride=self.stride, auto=self.auto)[0]
+        img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        if out is None:
+            return np.ascontiguousarray(img), img0
+        out[...] = img
+        return out, img0
+
+    def __len__(self):
+        return self.nf  # number of files
+
+
+class StagingPool:
+    # Reusable input tensors of the models. Same-shape uint8 images are normalized straight into a preallocated float
+    # BCHW tensor, one per image shape and concurrent caller, sliced to the batch size, instead of a fresh tensor per
+    # batch. On CUDA the uint8 pixels are staged in pinned host memory, copied asynchronously and normalized on the
+    # device. With reuse=False every batch gets fresh buffers, to measure the difference (benchmark.py --staging)
+    def __init__(self, device, channels_last=False, reuse=True):
+        self.device = device
+        self.channels_last = channels_last  # NHWC input tensors
+        self.reuse = reuse
+        self.free = {}  # (channels, height, width, channels_last) -> free (host, pixels, im) buffers
+        self.used = {}  # id of a staged tensor -> (key, buffers)
+        self.allocations, self.allocated = 0, 0  # buffers allocated and their bytes
+        self.lock = threading.Lock()
+
+    def put(self, ims, hwc=True):
+        # Normalized RGB BCHW float tensor on the device of same-shape letterboxed uint8 images: a list of BGR HWC
+        # images, or with hwc=False an RGB CHW or BCHW array as yielded by LoadImages. release() it after the forward
+        srcs = [x.transpose((2, 0, 1))[::-1] for x in ims] if hwc else ims[None] if ims.ndim == 3 else ims  # views
+        n, key = len(srcs), (*srcs[0].shape, self.channels_last)
+        with self.lock:
+            free = self.free.get(key)
+            buffers = free.pop() if free else None
+        if buffers is None or len(buffers[2]) < n:  # a too small buffer is dropped
+            buffers = self._allocate(key, n)
+        host, pixels, im = (x[:n] if x is not None else None for x in buffers)
+        if host is None:  # CPU, transpose, cast and scale every image into the input tensor in one pass
+            for x, out in zip(srcs, im.numpy()):
+                np.multiply(x, np.float32(1 / 255), out=out, casting='unsafe')
+        else:  # uint8 into pinned memory, asynchronous copy, normalized on the device
+            for x, out in zip(srcs, host.numpy()):
+                out[...] = x
+            pixels.copy_(host, non_blocking=True)
+            torch.mul(pixels, 1 / 255, out=im)
+        with self.lock:
+            self.used[id(im)] = key, buffers
+        return im
+
+    def release(self, im):
+        # Returns the buffers of a tensor from put() to the pool
+        with self.lock:
+            key, buffers = self.used.pop(id(im))
+            if self.reuse:
+                self.free.setdefault(key, []).append(buffers)
+
+    def nbytes(self):
+        # Bytes held by the pool, free and in use
+        with self.lock:
+            buffers = [b for free in self.free.values() for b in free] + [b for _, b in self.used.values()]
+        return sum(x.numel() * x.element_size() for b in buffers for x in b if x is not None)
+
+    def _allocate(self, key, n):
+        *shape, channels_last = key
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        im = torch.empty((n, *shape), device=self.device, memory_format=memory_format)
+        host = pixels = None
+        if self.device.type != 'cpu':
+            host = torch.empty((n, *shape), dtype=torch.uint8, pin_memory=self.device.type == 'cuda')
+            pixels = torch.empty_like(host, device=self.device)
+        with self.lock:
+            self.allocations += 1
+            self.allocated += sum(x.numel() * x.element_size() for x in (host, pixels, im) if x is not None)
+        return host, pixels, im
+
+
 def fitness(x):
     # Model fitness as a weighted combination of metrics
     w = [0.0, 0.0, 0.1, 0.9]  # weights for [P, R, mAP@0.5, mAP@0.5:0.95]
@@ -208,6 +208,40 @@ def fuse_conv_and_bn(conv, bn):
     return fusedconv
 
 
+def bf16_supported():
+    # True if the CPU computes bfloat16 natively (AVX512-BF16/AMX), elsewhere bf16 autocast is slower than FP32
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def quantize_dynamic(model):
+    # Dynamic int8 quantization, int8 weights and activations quantized on the fly. PyTorch only has dynamic kernels
+    # for Linear (and RNN) layers, so this quantizes C3TR transformer layers and leaves the convolutions FP32
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration, engine=None):
+    # Post-training static int8 quantization of the fused Conv layers, observers are calibrated on an iterable of
+    # BCHW input tensors. Each fused convolution runs quantize -> int8 conv -> dequantize, the SiLU and everything
+    # between Conv layers (Concat, Upsample, Detect) stays FP32
+    from common import Conv  # scoped to avoid circular import
+
+    engine = engine or ('fbgemm' if 'fbgemm' in torch.backends.quantized.supported_engines else 'qnnpack')
+    torch.backends.quantized.engine = engine
+    qconfig = torch.quantization.get_default_qconfig(engine)
+    for m in model.modules():
+        if isinstance(m, Conv) and not hasattr(m, 'bn'):  # fused Conv
+            m.conv = torch.quantization.QuantWrapper(m.conv)
+            m.conv.qconfig = qconfig
+    torch.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for im in calibration:
+            model(im)  # record activation ranges
+    return torch.quantization.convert(model, inplace=True)
+
+
 def model_info(model, verbose=False, img_size=640):
     # Model information. img_size may be int or list, i.e. img_size=640 or img_size=[640, 320]
     n_p = sum(x.numel() for x in model.parameters())  # number parameters
@@ -32,6 +32,7 @@ except ImportError:
 class Detect(nn.Module):
     stride = None  # strides computed during build
     onnx_dynamic = False  # ONNX export parameter
+    export = False  # export mode, return only the decoded output
 
     def __init__(self, nc=80, anchors=(), ch=(), inplace=True):  # detection layer
         super().__init__()
@@ -53,20 +54,31 @@ class Detect(nn.Module):
             x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
 
             if not self.training:  # inference
-                if self.onnx_dynamic or self.grid[i].shape[2:4] != x[i].shape[2:4]:
+                if self.onnx_dynamic:
                     self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)
+                    grid, anchor_grid = self.grid[i], self.anchor_grid[i]
+                else:  # locals, concurrent forward passes of other shapes share this module
+                    grid, anchor_grid = self._cached_grid(nx, ny, i)
 
                 y = x[i].sigmoid()
                 if self.inplace:
-                    y[..., 0:2] = (y[..., 0:2] * 2 - 0.5 + self.grid[i]) * self.stride[i]  # xy
-                    y[..., 2:4] = (y[..., 2:4] * 2) ** 2 * self.anchor_grid[i]  # wh
+                    y[..., 0:2] = (y[..., 0:2] * 2 - 0.5 + grid) * self.stride[i]  # xy
+                    y[..., 2:4] = (y[..., 2:4] * 2) ** 2 * anchor_grid  # wh
                 else:  # for YOLOv5 on AWS Inferentia https://github.com/ultralytics/yolov5/pull/2953
-                    xy = (y[..., 0:2] * 2 - 0.5 + self.grid[i]) * self.stride[i]  # xy
-                    wh = (y[..., 2:4] * 2) ** 2 * self.anchor_grid[i]  # wh
+                    xy = (y[..., 0:2] * 2 - 0.5 + grid) * self.stride[i]  # xy
+                    wh = (y[..., 2:4] * 2) ** 2 * anchor_grid  # wh
                     y = torch.cat((xy, wh, y[..., 4:]), -1)
                 z.append(y.view(bs, -1, self.no))
 
-        return x if self.training else (torch.cat(z, 1), x)
+        return x if self.training else (torch.cat(z, 1),) if self.export else (torch.cat(z, 1), x)
+
+    def _cached_grid(self, nx=20, ny=20, i=0):
+        # Grids of every input shape seen so far, switching between shapes (batches, warmup) does not rebuild them
+        cache = self.__dict__.setdefault('grid_cache', {})  # not in checkpoints pickled before the cache existed
+        key = i, nx, ny, self.anchors.device
+        if key not in cache:
+            cache[key] = self._make_grid(nx, ny, i)
+        return cache[key]
 
     def _make_grid(self, nx=20, ny=20, i=0):
         d = self.anchors[i].device
@@ -117,6 +129,8 @@ class Model(nn.Module):
         self.info()
 
     def forward(self, x, augment=False, profile=False, visualize=False):
+        if augment == 'batched':
+            return self._forward_augment_batched(x)  # augmented inference in one forward pass, None
         if augment:
             return self._forward_augment(x)  # augmented inference, None
         return self._forward_once(x, profile, visualize)  # single-scale inference, train
@@ -135,6 +149,28 @@ class Model(nn.Module):
         y = self._clip_augmented(y)  # clip augmented tails
         return torch.cat(y, 1), None  # augmented inference, train
 
+    def _forward_augment_batched(self, x):
+        # Same views as _forward_augment, each padded to the input shape so all of them run in a single forward pass
+        img_size = x.shape[-2:]  # height, width
+        s = [1, 0.83, 0.67]  # scales
+        f = [None, 3, None]  # flips (2-ud, 3-lr)
+        bs = x.shape[0]
+        xi = torch.cat([scale_img(x.flip(fi) if fi else x, si, same_shape=True) for si, fi in zip(s, f)], 0)
+        y = self._forward_once(xi)[0]  # forward (views*bs,n,no)
+        y = y.view(len(s), bs, *y.shape[1:])  # (views,bs,n,no)
+
+        # De-scale and de-flip all views at once
+        scale = torch.tensor(s, device=y.device).view(-1, 1, 1, 1)
+        lr = torch.tensor([fi == 3 for fi in f], device=y.device).view(-1, 1, 1)
+        ud = torch.tensor([fi == 2 for fi in f], device=y.device).view(-1, 1, 1)
+        p = y[..., :4] / scale  # de-scale
+        px = torch.where(lr, img_size[1] - p[..., 0], p[..., 0])  # de-flip lr
+        py = torch.where(ud, img_size[0] - p[..., 1], p[..., 1])  # de-flip ud
+        y = torch.cat((px[..., None], py[..., None], p[..., 2:4], y[..., 4:]), -1)
+
+        y = self._clip_augmented(list(y.unbind(0)))  # clip augmented tails
+        return torch.cat(y, 1), None  # augmented inference, train
+
     def _forward_once(self, x, profile=False, visualize=False):
         y, dt = [], []  # outputs
         for m in self.model:
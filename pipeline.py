@@ -0,0 +1,325 @@
+import io
+import sys
+import zipfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from KingdominoBoard import KingdominoBoard
+from Tile import Tile
+from helpers import IMG_FORMATS
+from metrics import timed
+
+CLASSES = (Path(__file__).resolve().parent / 'classes.txt').read_text().split('\n')  # class index -> tile name
+
+
+def load_picture(data, size=640, rect=False, stride=32):
+    """
+    Decodes an uploaded picture in memory, pads it to a white square and
+    resizes it to size x size. JPEGs much larger than size are decoded at a
+    reduced scale, and the picture is resized once before it is padded.
+
+    Parameters
+    ----------
+    data : bytes
+        the encoded image as uploaded
+    size : int, default=640
+        the square size of the returned image
+    rect : bool, default=False
+        keep the aspect ratio instead, the longest side resized to size and
+        the other one padded to a multiple of stride, see square_labels
+    stride : int, default=32
+        the detector's stride, only used with rect
+
+    Returns
+    -------
+    numpy.ndarray
+        HWC uint8 image in BGR channel order, as cv2.imread would return it,
+        a read-only view of the decoded RGB pixels
+    """
+    with timed('decode'):
+        img = Image.open(io.BytesIO(data))
+        r = size / max(img.size)
+        img.draft('RGB', (max(1, round(img.width * r)), max(1, round(img.height * r))))  # JPEG DCT scaling only
+        img.load()  # PIL decodes lazily
+
+    with timed('pad_resize'):
+        img = img.convert('RGB') if img.mode != 'RGB' else img  # P and 1 would be resized NEAREST
+        r = size / max(img.size)  # the draft may have decoded a smaller picture
+        width, height = max(1, round(img.width * r)), max(1, round(img.height * r))  # very elongated pictures
+        canvas = (-(-width // stride) * stride, -(-height // stride) * stride) if rect else (size, size)
+        new_img = Image.new('RGB', canvas, (255, 255, 255))
+        new_img.paste(img.resize((width, height)) if (width, height) != img.size else img)  # top left corner
+        return np.asarray(new_img)[:, :, ::-1]  # RGB to BGR
+
+
+def square_labels(detections, shape):
+    """
+    Rescales detections normalized to a rectangular picture to the frame of
+    the white square load_picture pads it to by default, so rectangular
+    inference returns the same labels. Padding at the bottom and right of
+    the picture does not change the result.
+
+    Parameters
+    ----------
+    detections : numpy.ndarray
+        (n, 6) [cls, x_mid, y_mid, width, height, conf] rows normalized to
+        the picture
+    shape : tuple of int
+        (height, width, ...) of the picture
+    """
+    detections = np.array(detections, dtype=np.float32).reshape(-1, 6)
+    height, width = shape[:2]
+    detections[:, [1, 3]] *= width / max(height, width)  # the picture sits in the top left corner of the square
+    detections[:, [2, 4]] *= height / max(height, width)
+    return detections
+
+
+def picture_hash(im0, size=8):
+    """
+    Difference hash (dHash) of a picture, similar pictures differ in few bits
+
+    Parameters
+    ----------
+    im0 : numpy.ndarray
+        HWC uint8 image in BGR channel order
+    size : int, default=8
+        the hash has size * size bits
+    """
+    gray = Image.fromarray(np.ascontiguousarray(im0[:, :, ::-1])).convert('L').resize((size + 1, size), Image.BILINEAR)
+    gray = np.asarray(gray, dtype=np.int16)
+    bits = gray[:, 1:] > gray[:, :-1]  # brightness gradient between neighbouring columns
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def format_labels(detections):
+    """
+    Formats detections as YOLO label lines joined by commas, the format
+    returned by the /file endpoint
+
+    Parameters
+    ----------
+    detections : numpy.ndarray
+        (n, 6) [cls, x_mid, y_mid, width, height, conf] rows, the confidence
+        is not part of the label format
+    """
+    detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+    buffer = io.StringIO()
+    np.savetxt(buffer, detections[:, :5], fmt='%g', delimiter=' ', newline=',')
+    return buffer.getvalue()[:-1]
+
+
+def score_board(detections, classes=CLASSES):
+    """
+    Builds the board from detections and returns its dimensions, tile grid,
+    tile scores and total score, or None if nothing was detected
+
+    Parameters
+    ----------
+    detections : numpy.ndarray
+        (n, 6) [cls, x_mid, y_mid, width, height, conf] rows
+    classes : list of str
+        tile name of every class index
+    """
+    if not len(detections):
+        return None
+    tiles = [Tile(classes[int(cls)], x_mid, y_mid, width, height)
+             for cls, x_mid, y_mid, width, height in np.asarray(detections)[:, :5].tolist()]
+    return KingdominoBoard(tiles).to_dict()
+
+
+def read_archive(data, name='archive', max_size=64 * 2 ** 20):
+    """
+    Yields the (name, bytes) of every picture in an uploaded zip archive.
+    A picture that cannot be read is yielded with the exception instead of
+    its bytes, so it fails on its own and the other pictures still run.
+
+    Parameters
+    ----------
+    data : bytes
+        the zip archive as uploaded
+    name : str, default='archive'
+        the name reported if the archive itself cannot be read
+    max_size : int, default=64 MiB
+        largest uncompressed size of a picture, larger ones are not read
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except Exception as e:  # BadZipFile, truncated upload
+        yield name, e
+        return
+
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or info.filename.startswith('__MACOSX/'):  # macOS resource forks
+                continue
+            if info.filename.split('.')[-1].lower() not in IMG_FORMATS:
+                continue
+            if info.file_size > max_size:
+                yield info.filename, ValueError(f'{info.file_size} bytes uncompressed, more than {max_size}')
+                continue
+            try:
+                picture = archive.read(info)
+            except Exception as e:  # BadZipFile, zlib.error, CRC mismatch
+                picture = e
+            yield info.filename, picture
+
+
+def score_picture(detector, data, cache=None, near_cache=None, score=False, size=640, rect=False, stride=32):
+    """
+    Runs an uploaded picture through the detector without touching the disk
+    and builds the /file response
+
+    Parameters
+    ----------
+    detector : Detector
+        the resident detector
+    data : bytes
+        the encoded image as uploaded
+    cache : ResultCache, optional
+        detections of previous uploads, checked before decoding
+    near_cache : PerceptualCache, optional
+        detections of previous uploads of the same board, checked after decoding
+    score : bool, default=False
+        also build and score the board server-side
+    size : int, default=640
+        the detector's inference size, the picture is resized to it once
+    rect : bool, default=False
+        rectangular inference, the picture is not padded to a square
+    stride : int, default=32
+        the detector's stride, rectangular pictures are padded to a multiple
+    """
+    detections, im0, key, near_key = _lookup(data, cache, near_cache, size, rect, stride)
+    if detections is None:
+        detections = detector.detect(im0)
+        detections = square_labels(detections, im0.shape) if rect else detections
+        _store(detections, key, near_key, cache, near_cache)
+    return _response(detections, score)
+
+
+def score_batch(detector, pictures, cache=None, near_cache=None, batch_size=8, score=False, size=640, rect=False,
+                stride=32):
+    """
+    Runs many uploaded pictures through the detector in batches and yields
+    one result per picture as soon as its batch is done. A picture that
+    fails is reported in its own result and does not stop the others.
+    Pictures are batched with pictures of the same aspect ratio, only those
+    can be stacked into one forward pass.
+
+    Parameters
+    ----------
+    detector : Detector
+        the resident detector
+    pictures : iterable of (str, bytes)
+        the name and encoded image of every upload, or the exception raised
+        reading it (see read_archive)
+    cache : ResultCache, optional
+        detections of previous uploads, checked before decoding
+    near_cache : PerceptualCache, optional
+        detections of previous uploads of the same board, checked after decoding
+    batch_size : int, default=8
+        pictures run through the detector together
+    score : bool, default=False
+        also build and score every board server-side
+    size : int, default=640
+        the detector's inference size, the pictures are resized to it once
+    rect : bool, default=False
+        rectangular inference, the pictures are not padded to a square
+    stride : int, default=32
+        the detector's stride, rectangular pictures are padded to a
+        multiple and pictures with the same padded shape share a batch
+    """
+    buckets = {}  # padded shape -> (name, im0, key, near_key) of cache misses waiting for inference
+    for name, data in pictures:
+        try:
+            if isinstance(data, Exception):
+                raise data
+            detections, im0, key, near_key = _lookup(data, cache, near_cache, size, rect, stride)
+        except Exception as e:  # unreadable picture
+            yield {'name': name, 'result': 400, 'error': str(e)}
+            continue
+
+        if detections is not None:
+            yield _named_response(name, detections, score)
+        else:
+            bucket = im0.shape[:2]  # load_picture pads to the stride
+            pending = buckets.setdefault(bucket, [])
+            pending.append((name, im0, key, near_key))
+            if len(pending) == batch_size:
+                yield from _score_pending(detector, buckets.pop(bucket), cache, near_cache, score, rect, batch_size)
+    for pending in buckets.values():
+        yield from _score_pending(detector, pending, cache, near_cache, score, rect, batch_size)
+
+
+def _score_pending(detector, pending, cache, near_cache, score, rect=False, batch_size=8):
+    """ Runs the decoded cache misses through the detector as one batch """
+    if not pending:
+        return
+    try:
+        results = detector.detect_batch([im0 for _, im0, _, _ in pending], batch_size=batch_size)
+    except Exception as e:
+        for name, *_ in pending:
+            yield {'name': name, 'result': 500, 'error': str(e)}
+        return
+
+    for (name, im0, key, near_key), detections in zip(pending, results):
+        detections = square_labels(detections, im0.shape) if rect else detections
+        _store(detections, key, near_key, cache, near_cache)
+        yield _named_response(name, detections, score)
+
+
+def _lookup(data, cache, near_cache, size=640, rect=False, stride=32):
+    """
+    Looks an upload up in the caches, decoding it only when the exact cache
+    misses. Returns its detections (None on a miss), the decoded picture and
+    both cache keys
+    """
+    key = near_key = im0 = None
+    if cache is not None:
+        key = cache.key(data)
+        detections = cache.get(key)
+        if detections is not None:
+            return detections, im0, key, near_key
+
+    im0 = load_picture(data, size, rect=rect, stride=stride)
+    if near_cache is not None:
+        near_key = picture_hash(im0)
+        detections = near_cache.get(near_key)
+        if detections is not None:
+            if cache is not None:
+                cache.put(key, detections)
+            return detections, im0, key, near_key
+    return None, im0, key, near_key
+
+
+def _store(detections, key, near_key, cache, near_cache):
+    """ Stores fresh detections in both caches """
+    if cache is not None:
+        cache.put(key, detections)
+    if near_cache is not None:
+        near_cache.put(near_key, detections)
+
+
+def _named_response(name, detections, score):
+    """ Builds the /batch result of one picture """
+    try:
+        return dict(_response(detections, score), name=name)
+    except Exception as e:  # board could not be built
+        return {'name': name, 'result': 500, 'error': str(e)}
+
+
+def _response(detections, score=False):
+    """ Builds the /file response of detections, with the scored board if asked for """
+    with timed('format'):
+        labels = format_labels(detections)
+    status = 300 if len(labels) == 0 else 200
+    response = {'result': status, 'labels': labels}
+    if score:
+        with timed('board'):
+            response['board'] = score_board(detections)
+    return response
@@ -0,0 +1,219 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Content-addressed cache of detections for uploaded pictures.
+
+    Keys hash the uploaded bytes together with everything that changes the
+    detections (weights, conf_thres, iou_thres), so a re-upload of the same
+    photo returns the stored detections without running the model.
+
+    ...
+
+    Attributes
+    ---------
+    max_entries : int
+        the most results kept, least recently used ones are evicted first
+    ttl : float
+        seconds a result stays valid, None to never expire
+    params : tuple
+        the weights and thresholds the cached detections were made with
+    hits : int
+        number of lookups that found a valid result
+    misses : int
+        number of lookups that did not
+
+    Methods
+    -------
+    key(data)
+        Returns the cache key of uploaded bytes
+    get(key)
+        Returns the cached result of a key, or None
+    put(key, result)
+        Stores a result
+    stats()
+        Returns the hit/miss counters and size of the cache
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, params=()):
+        """
+        Parameters
+        ----------
+        max_entries : int, default=1024
+            the most results kept
+        ttl : float, default=3600
+            seconds a result stays valid, None to never expire
+        params : tuple, default=()
+            the weights and thresholds, part of every key
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.params = params
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry, result), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, data):
+        """
+        Returns the cache key of uploaded bytes
+
+        Parameters
+        ----------
+        data : bytes
+            the encoded image as uploaded
+        """
+        h = hashlib.sha256(repr(self.params).encode())
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached result of a key, or None if missing or expired
+
+        Parameters
+        ----------
+        key : str
+            a key returned by key()
+        """
+        with self._lock:
+            key = self._find(key)
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                self._remove(key)  # expired
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        """
+        Stores a result, evicting the least recently used one when full
+
+        Parameters
+        ----------
+        key : str
+            a key returned by key()
+        result : object
+            the detections of the picture
+        """
+        with self._lock:
+            if key not in self._entries:
+                self._add(key)
+            self._entries[key] = (None if self.ttl is None else time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _find(self, key):
+        """ Returns the stored key matching key, or None """
+        return key if key in self._entries else None
+
+    def _add(self, key):
+        """ Called before a new key is stored """
+
+    def _remove(self, key):
+        """ Drops a stored key """
+        del self._entries[key]
+
+    def stats(self):
+        """ Returns the hit/miss counters and size of the cache """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                    'entries': len(self._entries),
+                    'max_entries': self.max_entries}
+
+
+class PerceptualCache(ResultCache):
+    """
+    Near-duplicate cache of detections keyed by a perceptual hash of the
+    picture, for photos of the same board that are not byte-identical.
+
+    Hashes are split into distance + 1 chunks and indexed per chunk. Two
+    hashes within the Hamming distance share at least one chunk exactly, so a
+    lookup only compares the hashes that share a chunk with it.
+
+    ...
+
+    Attributes
+    ---------
+    distance : int
+        the largest Hamming distance treated as the same board
+    bits : int
+        the number of bits in a hash
+
+    Methods
+    -------
+    get(key)
+        Returns the result of the closest stored hash within distance, or None
+    put(key, result)
+        Stores the result of a hash
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, params=(), distance=4, bits=64):
+        """
+        Parameters
+        ----------
+        max_entries : int, default=1024
+            the most results kept
+        ttl : float, default=3600
+            seconds a result stays valid, None to never expire
+        params : tuple, default=()
+            the weights and thresholds the cached detections were made with
+        distance : int, default=4
+            the largest Hamming distance treated as the same board
+        bits : int, default=64
+            the number of bits in a hash
+        """
+        super().__init__(max_entries, ttl, params)
+        self.distance = distance
+        self.bits = bits
+        chunks = min(distance + 1, bits)
+        self._chunks = [((1 << (bits * (i + 1) // chunks - bits * i // chunks)) - 1, bits * i // chunks)
+                        for i in range(chunks)]  # (mask, shift) of every chunk
+        self._tables = [{} for _ in self._chunks]  # chunk value -> stored hashes
+
+    def stats(self):
+        """ Returns the hit/miss counters and size of the cache """
+        stats = super().stats()
+        stats['distance'] = self.distance
+        return stats
+
+    def _find(self, key):
+        """ Returns the closest stored hash within distance, or None """
+        best, best_distance = None, self.distance + 1
+        candidates = set()
+        for table, (mask, shift) in zip(self._tables, self._chunks):
+            candidates.update(table.get((key >> shift) & mask, ()))
+        for candidate in candidates:
+            d = bin(candidate ^ key).count('1')  # Hamming distance
+            if d < best_distance:
+                best, best_distance = candidate, d
+        return best
+
+    def _add(self, key):
+        """ Indexes a new hash by each of its chunks """
+        for table, (mask, shift) in zip(self._tables, self._chunks):
+            table.setdefault((key >> shift) & mask, set()).add(key)
+
+    def _remove(self, key):
+        """ Drops a stored hash and its index entries """
+        super()._remove(key)
+        for table, (mask, shift) in zip(self._tables, self._chunks):
+            chunk = (key >> shift) & mask
+            table[chunk].discard(key)
+            if not table[chunk]:
+                del table[chunk]
@@ -0,0 +1,75 @@
+"""
+Server settings shared by app.py and async_app.py, read from environment
+variables and the autotune.py profile of this host, so both serving modes
+load, tune and cache the models the same way
+"""
+
+import os
+import sys
+from pathlib import Path
+
+MODELS = Path(__file__).resolve().parent / 'models'
+if str(MODELS) not in sys.path:
+    sys.path.append(str(MODELS))  # models/ modules use flat imports
+
+from detector import get_detector, read_profile
+from result_cache import PerceptualCache, ResultCache
+
+PROFILE = read_profile(os.getenv('AUTOTUNE_PROFILE', 'autotune.json'))  # host tuning written by autotune.py
+WEIGHTS = os.getenv('WEIGHTS', 'models/kd_mod_med.pt')  # .pt, or .torchscript/.onnx from models/export.py
+IMGSZ = tuple(PROFILE.get('imgsz', (640, 640)))  # inference size (height, width)
+PRECISION = os.getenv('PRECISION', 'fp32')  # CPU precision: fp32, bf16, dynamic or static (int8)
+CALIBRATION = os.getenv('CALIBRATION', 'pictures/images/train')  # static int8 calibration pictures
+INTRA_THREADS = int(os.getenv('INTRA_THREADS', 0))  # ONNX Runtime threads per operator, 0 for all cores
+INTER_THREADS = int(os.getenv('INTER_THREADS', 0))  # ONNX Runtime threads between operators, 0 for sequential
+RECT = os.getenv('RECT', '0').lower() in ('1', 'true', 'yes')  # keep the aspect ratio, pad to the stride only
+MAX_TILES = int(os.getenv('MAX_TILES', 0))  # Kingdomino-aware NMS tile budget (49, or 81 for 9x9), 0 for generic
+CONF_THRES = 0.5  # confidence threshold, same as Detector.detect
+IOU_THRES = 0.45  # NMS IoU threshold, same as Detector.detect
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', PROFILE.get('batch_size', 8)))  # largest batch in one forward pass
+CACHE_ENTRIES = int(os.getenv('CACHE_ENTRIES', 1024))  # results cached by upload hash, 0 to disable
+CACHE_TTL = float(os.getenv('CACHE_TTL', 3600))  # seconds a cached result stays valid
+NEAR_DISTANCE = int(os.getenv('NEAR_DISTANCE', -1))  # max dHash bits apart for the same board, -1 to disable
+
+
+def load_detector(threads=True):
+    """
+    Loads and fuses the resident detector once at startup and applies the
+    host profile (torch threads and memory format)
+
+    Parameters
+    ----------
+    threads : bool, default=True
+        apply the profile's torch thread count, False when inference
+        processes split the cores between them
+    """
+    detector = get_detector(WEIGHTS, imgsz=IMGSZ, precision=PRECISION, calibration=CALIBRATION,
+                            intra_threads=INTRA_THREADS, inter_threads=INTER_THREADS, max_tiles=MAX_TILES)
+    detector.configure(threads=PROFILE.get('threads') if threads else None, channels_last=PROFILE.get('channels_last'))
+    return detector
+
+
+def picture_options(detector):
+    """
+    Keyword arguments of score_picture and score_batch for the detector:
+    uploads are resized once to its inference size, and padded to its
+    stride only with rectangular inference
+    """
+    return dict(size=max(detector.imgsz), rect=RECT, stride=detector.stride)
+
+
+def warmup_shapes(detector):
+    """ Letterboxed shapes to warm up, 4:3 and 16:9 both ways with rectangular inference, imgsz otherwise """
+    return detector.rect_shapes() if RECT else None
+
+
+def load_caches(detector):
+    """
+    Returns the exact and the perceptual result cache, None if disabled.
+    Their keys include everything that changes the detections.
+    """
+    params = WEIGHTS, detector.precision, tuple(detector.imgsz), RECT, MAX_TILES, CONF_THRES, IOU_THRES
+    cache = ResultCache(CACHE_ENTRIES, CACHE_TTL, params=params) if CACHE_ENTRIES > 0 else None
+    near_cache = PerceptualCache(CACHE_ENTRIES, CACHE_TTL, params=params,
+                                 distance=NEAR_DISTANCE) if CACHE_ENTRIES > 0 and NEAR_DISTANCE >= 0 else None
+    return cache, near_cache
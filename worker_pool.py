@@ -0,0 +1,232 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty
+
+
+def _work(index, detector, tasks, results, threads, conf_thres, iou_thres, max_det, shapes=None):
+    """ Inference worker loop, runs in a forked child process """
+    detector.configure(threads=threads)  # split the cores between workers instead of oversubscribing them
+    detector.warmup(shapes=shapes)  # workers take one image at a time
+    results.put((None, index, None, None, detector.warmup_time))  # ready
+    while True:
+        task = tasks.get()  # only ever the image the parent handed to this worker
+        if task is None:  # shutdown sentinel
+            break
+        task_id, im0 = task
+        t = time.perf_counter()
+        try:
+            result, error = detector.detect(im0, conf_thres, iou_thres, max_det), None
+        except Exception as e:
+            result, error = None, repr(e)
+        results.put((task_id, index, result, error, time.perf_counter() - t))
+
+
+class WorkerPool:
+    """
+    Pool of inference processes that share one loaded copy of the weights.
+
+    The detector is loaded and fused in the parent, its tensors are moved to
+    shared memory and the workers are forked from it, so N workers cost one
+    set of weights. The parent hands the next image to an idle worker
+    through its own queue, so it always knows which image a worker holds.
+
+    ...
+
+    Attributes
+    ---------
+    detector : Detector
+        the resident detector shared by the workers
+    processes : list[multiprocessing.Process]
+        the inference workers
+    threads : int
+        intra-op torch threads per worker
+
+    Methods
+    -------
+    submit(im0)
+        Queues a BGR HWC image and returns a Future of its detections
+    detect(im0)
+        Blocks until the detections of a BGR HWC image are available
+    detect_batch(im0s, batch_size=None)
+        Spreads several BGR HWC images over the workers and blocks until all are done
+    pending()
+        Returns the number of images queued or in inference
+    ready()
+        Returns True once every worker is warmed up and alive
+    stats()
+        Returns the images processed and throughput of each worker
+    close()
+        Stops the workers
+    """
+
+    def __init__(self, detector, processes=2, threads=None, conf_thres=0.5, iou_thres=0.45, max_det=1000,
+                 shapes=None, poll=1.0):
+        """
+        Parameters
+        ----------
+        detector : Detector
+            the resident detector, must not have run inference yet so the
+            forked workers start from a clean thread pool, static int8
+            calibration runs inference at load time
+        processes : int, default=2
+            number of inference workers
+        threads : int, optional
+            torch threads per worker, defaults to the cores split evenly
+        conf_thres : float, default=0.5
+            confidence threshold
+        iou_thres : float, default=0.45
+            NMS IoU threshold
+        max_det : int, default=1000
+            maximum detections per image
+        shapes : list of tuple, optional
+            letterboxed (height, width) shapes the workers warm up for,
+            defaults to the detector's imgsz
+        poll : float, default=1.0
+            seconds between liveness checks of idle workers, the images of
+            a dead worker fail instead of waiting forever
+        """
+        assert not detector.model.onnx, 'ONNX Runtime sessions do not survive a fork, use .pt or .torchscript weights'
+        assert detector.precision != 'static', 'static int8 calibration ran inference before the fork, use dynamic'
+        self.detector = detector
+        self.threads = threads or max(1, (os.cpu_count() or 1) // processes)
+        self.detector.model.share_memory()  # weights stay shared even if a worker writes to a page
+
+        ctx = multiprocessing.get_context('fork')  # workers inherit the loaded models, nothing is pickled
+        self._tasks = [ctx.Queue() for _ in range(processes)]  # images handed to each worker
+        self._results = ctx.Queue()
+        self.poll = poll
+        self.processes = [ctx.Process(target=_work, name=f'inference-{i}', daemon=True,
+                                      args=(i, detector, self._tasks[i], self._results, self.threads,
+                                            conf_thres, iou_thres, max_det, shapes))
+                          for i in range(processes)]
+        for p in self.processes:
+            p.start()
+
+        self._ids = itertools.count()
+        self._futures = {}  # task id -> Future
+        self._backlog = collections.deque()  # (task id, image) not handed to a worker yet
+        self._running = [None] * processes  # task id handed to each worker, None if idle
+        self._lock = threading.Lock()
+        self._images = [0] * processes  # images processed per worker
+        self._busy = [0.0] * processes  # seconds spent in inference per worker
+        self._ready = [False] * processes  # warmed up workers
+        self._dead = set()  # indices of workers that exited
+        self._dispatcher = threading.Thread(target=self._dispatch, name='worker-pool', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, im0):
+        """
+        Queues an image for the next idle worker
+
+        Parameters
+        ----------
+        im0 : numpy.ndarray
+            HWC uint8 image in BGR channel order
+        """
+        future = Future()
+        with self._lock:
+            if len(self._dead) == len(self.processes):
+                future.set_exception(RuntimeError('every inference worker exited'))
+                return future
+            task_id = next(self._ids)
+            self._futures[task_id] = future
+            self._backlog.append((task_id, im0))
+            self._assign()
+        return future
+
+    def detect(self, im0):
+        """ Blocks until the [cls, x, y, w, h, conf] detections of an image are available """
+        return self.submit(im0).result()
+
+    def detect_batch(self, im0s, batch_size=None):
+        """
+        Spreads several images over the workers and blocks until all their
+        detections are available. batch_size is accepted like
+        Detector.detect_batch, workers take one image at a time.
+        """
+        return [future.result() for future in [self.submit(im0) for im0 in im0s]]
+
+    def pending(self):
+        """ Returns the number of images queued or in inference """
+        with self._lock:
+            return len(self._futures)
+
+    def ready(self):
+        """ Returns True once every worker is warmed up and alive """
+        return all(self._ready) and not self._dead
+
+    def stats(self):
+        """ Returns the images processed, busy time and throughput of each worker """
+        with self._lock:
+            return [{'worker': i,
+                     'pid': p.pid,
+                     'alive': i not in self._dead,
+                     'images': n,
+                     'busy': round(t, 3),  # seconds
+                     'throughput': round(n / t, 2) if t else 0.0}  # images per busy second
+                    for i, (p, n, t) in enumerate(zip(self.processes, self._images, self._busy))]
+
+    def close(self):
+        """ Stops the workers once they finish their current image """
+        for tasks in self._tasks:
+            tasks.put(None)
+        for p in self.processes:
+            p.join()
+
+    def _dispatch(self):
+        """ Resolves the futures of finished images, runs on its own daemon thread """
+        while True:
+            try:
+                task_id, index, result, error, dt = self._results.get(timeout=self.poll)
+            except Empty:
+                self._reap()
+                continue
+            if task_id is None:  # worker warmed up
+                with self._lock:
+                    self._ready[index] = True
+                    self._assign()
+                continue
+            with self._lock:
+                future = self._futures.pop(task_id, None)  # None if already failed by _reap
+                self._images[index] += 1
+                self._busy[index] += dt
+                self._running[index] = None
+                self._assign()
+            if future is not None and error is None:
+                future.set_result(result)
+            elif future is not None:
+                future.set_exception(RuntimeError(f'inference worker {index} failed: {error}'))
+            self._reap()
+
+    def _assign(self):
+        """ Hands backlog images to idle, warmed up and live workers, called with the lock held """
+        for i, task_id in enumerate(self._running):
+            if not self._backlog:
+                break
+            if task_id is None and self._ready[i] and i not in self._dead:
+                task = self._backlog.popleft()
+                self._running[i] = task[0]  # failed by _reap if this worker dies
+                self._tasks[i].put(task)
+
+    def _reap(self):
+        """ Fails the image of every worker that died (OOM, segfault) and, once none is left, every queued image """
+        failed = []
+        with self._lock:
+            for i, p in enumerate(self.processes):
+                if i in self._dead or p.is_alive():
+                    continue
+                self._dead.add(i)
+                task_id, self._running[i] = self._running[i], None
+                if task_id in self._futures:
+                    failed.append((self._futures.pop(task_id), f'inference worker {i} exited with code {p.exitcode}'))
+            if self._futures and len(self._dead) == len(self.processes):
+                failed += [(future, 'every inference worker exited') for future in self._futures.values()]
+                self._futures.clear()
+                self._backlog.clear()
+        for future, message in failed:
+            future.set_exception(RuntimeError(message))